@@ -0,0 +1,362 @@
+# Benchmark offline delle fasi calde (parse / estrattori / feed in streaming /
+# pulizia / classificazione / quasi-duplicati / formattazione / traduzione / invio
+# / outbox degli shard) su fixture locali in fixtures/.
+# Niente rete e niente BOT_TOKEN: traduttore e Telegram sono stub locali.
+#
+#   python bench.py                                # tutte le fasi, 10..100k annunci
+#   python bench.py --sizes 10,1000 --stages parse_html,classify
+#   python bench.py --json bench.json              # salva i risultati
+#   python bench.py --baseline bench.json          # fallisce se una fase rallenta
+import io
+import os
+import re
+import sys
+import json
+import time
+import queue
+import types
+import argparse
+import contextlib
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+DEFAULT_SIZES = (10, 100, 1000, 10000, 100000)
+# traduzione e invio passano per langdetect/sqlite: oltre questo numero di
+# annunci il throughput non cambia, si misura solo un campione
+SAMPLED_STAGE_LIMIT = 2000
+
+
+# ======================
+# STUB (traduttore, Telegram)
+# ======================
+class StubTranslator:
+    def __init__(self, source="auto", target="en"):
+        self.target = target
+
+    def translate(self, text):
+        return f"[{self.target}] {text}"
+
+
+class StubMessage:
+    def __init__(self):
+        self.photo = [types.SimpleNamespace(file_id="stub-file-id")]
+
+
+class StubBot:
+    def __init__(self):
+        self.calls = 0
+
+    def _call(self, **kwargs):
+        self.calls += 1
+        return StubMessage()
+
+    send_photo = send_message = _call
+
+    def send_media_group(self, **kwargs):
+        self.calls += 1
+        return [StubMessage() for _ in kwargs.get("media", [])]
+
+
+def install_stubs():
+    # il traduttore è sempre sostituito: il benchmark non deve mai uscire in rete
+    mod = types.ModuleType("deep_translator")
+    mod.GoogleTranslator = StubTranslator
+    sys.modules["deep_translator"] = mod
+    try:
+        import telegram.error  # noqa: F401
+    except ImportError:
+        class RetryAfter(Exception):
+            retry_after = 0
+
+        tg = types.ModuleType("telegram")
+        tg_error = types.ModuleType("telegram.error")
+        tg_error.RetryAfter = RetryAfter
+        tg.error = tg_error
+        sys.modules["telegram"] = tg
+        sys.modules["telegram.error"] = tg_error
+
+
+class FakeResponse:
+    def __init__(self, content: bytes, url: str, content_type: str):
+        self.content = content
+        self.url = url
+        self.status_code = 200
+        self.headers = {"Content-Type": content_type}
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+# ======================
+# FIXTURE SCALATE
+# ======================
+def scale_html(n: int) -> str:
+    # replica i blocchi <h3> dell'articolo fino a n annunci con nomi univoci
+    html = (FIXTURES / "rifugio_page.html").read_text(encoding="utf-8")
+    start, end = html.index("<h3>"), html.index("</article>")
+    blocks = [b for b in re.split(r"(?=<h3>)", html[start:end]) if b.strip()]
+    body = "".join(blocks[i % len(blocks)].replace("</h3>", f" #{i}</h3>", 1) for i in range(n))
+    return html[:start] + body + html[end:]
+
+
+def scale_cards(n: int) -> str:
+    # griglia di schede (estrattore per sito di adoptapet.com)
+    html = (FIXTURES / "cards_page.html").read_text(encoding="utf-8")
+    cards = re.findall(r'<div class="pet-card".*?</a>\s*</div>', html, re.S)
+    start = html.index(cards[0])
+    end = html.index(cards[-1]) + len(cards[-1])
+    body = "".join(
+        cards[i % len(cards)].replace("</h3>", f" #{i}</h3>", 1).replace('/pet/', f'/pet/{i}-', 1)
+        for i in range(n)
+    )
+    return html[:start] + body + html[end:]
+
+
+def scale_feed(n: int) -> bytes:
+    xml = (FIXTURES / "feed_wordpress.xml").read_text(encoding="utf-8")
+    items = re.findall(r"<item>.*?</item>", xml, re.S)
+    head, tail = xml[:xml.index("<item>")], xml[xml.rindex("</item>") + len("</item>"):]
+    out = []
+    for i in range(n):
+        it = items[i % len(items)]
+        it = re.sub(r"<link>(.*?)/</link>", rf"<link>\1-{i}/</link>", it, count=1)
+        it = re.sub(r"</title>", f" #{i}</title>", it, count=1)
+        out.append(it)
+    return (head + "".join(out) + tail).encode("utf-8")
+
+
+# ======================
+# FASI
+# ======================
+def prepare(main, n: int) -> dict:
+    html = scale_html(n)
+    cards = scale_cards(n)
+    feed = FakeResponse(scale_feed(n), "https://www.dogsblog.com/feed/", "application/rss+xml; charset=UTF-8")
+    animals = main.parse_rifugio_page(html, "https://www.rifugioapachioggia.it/centro-adozioni", "dog")
+    entries = main.parse_feed(feed).entries
+    texts = [(a.name, a.desc, a.page) for a in animals]
+    texts += [(e.title, e.get("summary", ""), e.link) for e in entries]
+    texts = texts[:n]
+    cleaned = [(t, main.remove_wp_footer(main.clean_html(d)), u) for t, d, u in texts]
+    return {"html": html, "cards": cards, "feed": feed, "texts": texts, "cleaned": cleaned}
+
+
+def stage_parse_html(main, data):
+    return len(main.parse_rifugio_page(data["html"], "https://www.rifugioapachioggia.it/centro-adozioni", "dog"))
+
+
+def stage_extract_cards(main, data):
+    return len(main.parse_page(data["cards"], "https://www.adoptapet.com/dog-adoption", "dog"))
+
+
+def stage_parse_feed(main, data):
+    return len(main.parse_feed(data["feed"]).entries)
+
+
+def stage_stream_feed(main, data):
+    # lettura completa: misura il parser incrementale, non l'arresto anticipato
+    return sum(1 for _ in main.stream_feed(data["feed"], data["feed"].url))
+
+
+def stage_clean(main, data):
+    for _, desc, _ in data["texts"]:
+        main.remove_wp_footer(main.clean_html(desc))
+    return len(data["texts"])
+
+
+def stage_classify(main, data):
+    for title, raw, url in data["cleaned"]:
+        main.scan_keywords.cache_clear()
+        main.looks_like_adoption(title, raw)
+        main.detect_species(title, raw)
+        main.detect_country(url)
+    return len(data["cleaned"])
+
+
+def stage_near_dup(main, data):
+    # impronte e ricerca per bande (solo in memoria: il DB del benchmark è vuoto)
+    index = main.NearDupIndex(main.db())
+    for title, raw, _ in data["cleaned"]:
+        fp = main.simhash(title + "\n" + raw)
+        if fp is not None and not index.find(fp):
+            index.claim(fp)
+    return len(data["cleaned"])
+
+
+def stage_format(main, data):
+    languages = ("en", "it", "es", "fr", "de")
+    for title, raw, url in data["cleaned"]:
+        tags = main.build_hashtags("dog", "IT", "it")
+        texts = dict.fromkeys(languages, raw)
+        main.build_message(title, "dog", "IT", texts, languages, url, tags, limit=main.TELEGRAM_CAPTION_MAX)
+        main.build_message(title, "dog", "IT", texts, languages, url, tags)
+    return len(data["cleaned"])
+
+
+def stage_translate(main, data):
+    sample = data["cleaned"][:SAMPLED_STAGE_LIMIT]
+    for _, raw, _ in sample:
+        main.translate_all(raw)
+    return len(sample)
+
+
+def stage_send(main, data):
+    bot = StubBot()
+    sample = data["cleaned"][:SAMPLED_STAGE_LIMIT]
+    # send_post stampa una riga [OK] per annuncio
+    with contextlib.redirect_stdout(io.StringIO()):
+        for title, raw, url in sample:
+            main.send_post(bot, main.CHANNEL, title, raw, raw, [])
+    return len(sample)
+
+
+def stage_outbox(main, data):
+    # lease, outbox e publisher su un DB vuoto. Gli assert fanno fallire il
+    # benchmark se due proprietari prendono la stessa lease o se il publisher
+    # invia annunci già in seen_ads
+    sample = data["cleaned"][:SAMPLED_STAGE_LIMIT]
+    conn = main.db()
+    with conn:
+        for table in ("outbox", "leases", "seen_ads"):
+            conn.execute(f"DELETE FROM {table}")
+    inbox = queue.Queue()
+    seen = []
+    for i, (title, raw, url) in enumerate(sample):
+        ad_id = main.make_ad_id(url, title, str(i))
+        assert main.take_lease(ad_id, "shard0", 60), "lease libera non presa"
+        assert not main.take_lease(ad_id, "shard1", 60), "lease presa da due proprietari"
+        inbox.put({
+            "ad_id": ad_id, "source": url, "save_url": url, "title": title, "raw": raw,
+            "species": "dog", "country": "IT", "url": url, "images": [], "referer": url,
+            "simhash": None, "lang": "it", "texts": {"en": raw}, "hashtags": "#dog",
+            "messages": {main.CHANNEL: (raw[:main.TELEGRAM_CAPTION_MAX], raw)},
+        })
+        if i % 2:
+            seen.append((ad_id, url, 0, 0))
+    inbox.put(main._DONE)
+    sleep, main.SLEEP_BETWEEN_POSTS_SEC = main.SLEEP_BETWEEN_POSTS_SEC, 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        main.outbox_stage(inbox)
+        conn = main.db()
+        with conn:
+            conn.executemany("INSERT INTO seen_ads VALUES (?,?,?,?)", seen)
+        bot = StubBot()
+        app = types.SimpleNamespace(
+            bot=bot, owner="bench", seen=main.SeenStore(conn), near=main.NearDupIndex(conn), image_pool=None,
+        )
+        sent = main.publish(app, limit=len(sample))
+    main.SLEEP_BETWEEN_POSTS_SEC = sleep
+    assert sent == bot.calls == len(sample) - len(seen), "il publisher ha inviato annunci già visti"
+    assert main.outbox_pending() == 0, "outbox non svuotata"
+    assert conn.execute("SELECT COUNT(*) FROM leases").fetchone()[0] == 0, "lease rimaste"
+    return len(sample)
+
+
+STAGES = {
+    "parse_html": stage_parse_html,
+    "extract_cards": stage_extract_cards,
+    "parse_feed": stage_parse_feed,
+    "stream_feed": stage_stream_feed,
+    "clean": stage_clean,
+    "classify": stage_classify,
+    "near_dup": stage_near_dup,
+    "format": stage_format,
+    "translate": stage_translate,
+    "send": stage_send,
+    "outbox": stage_outbox,
+}
+
+
+def measure(fn, main, data, memory: bool, repeat: int) -> dict:
+    # miglior tempo su `repeat` passate: meno rumore sulle taglie piccole
+    elapsed = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        items = fn(main, data)
+        elapsed = min(elapsed, time.perf_counter() - t0)
+    out = {"items": items, "seconds": round(elapsed, 4), "items_per_sec": round(items / elapsed, 1) if elapsed else None}
+    if memory:
+        # seconda passata sotto tracemalloc (rallenta, non va nei tempi)
+        tracemalloc.start()
+        fn(main, data)
+        out["peak_kb"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+        tracemalloc.stop()
+    return out
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for stage, by_size in results.items():
+        for size, r in by_size.items():
+            old = baseline.get(stage, {}).get(size)
+            if not old or not old.get("items_per_sec") or not r.get("items_per_sec"):
+                continue
+            if r["items_per_sec"] < old["items_per_sec"] * (1 - tolerance):
+                regressions.append(f"{stage}@{size}: {r['items_per_sec']} it/s (baseline {old['items_per_sec']})")
+    return regressions
+
+
+def main_cli(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark offline delle fasi del bot")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)))
+    parser.add_argument("--stages", default=",".join(STAGES))
+    parser.add_argument("--repeat", type=int, default=3, help="passate per fase (ridotte sulle taglie grandi)")
+    parser.add_argument("--no-memory", action="store_true", help="salta la misura del picco di memoria")
+    parser.add_argument("--json", help="scrive i risultati in questo file")
+    parser.add_argument("--baseline", help="confronta con un JSON precedente")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="rallentamento massimo ammesso (0.3 = 30%%)")
+    args = parser.parse_args(argv)
+
+    install_stubs()
+    import main
+
+    # DB temporanei per cache traduzioni e archivio: ads.db non viene toccato
+    tmp = tempfile.TemporaryDirectory()
+    main.DB_PATH = os.path.join(tmp.name, "bench.db")
+    main.ARCHIVE_DB_PATH = os.path.join(tmp.name, "archive.db")
+    main.init_db()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    stages = [s for s in args.stages.split(",") if s]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"fasi sconosciute: {', '.join(sorted(unknown))}")
+
+    results = {s: {} for s in stages}
+    print(f"{'stage':<14} {'size':>7} {'items':>7} {'items/s':>11} {'peak KB':>10}")
+    for n in sizes:
+        data = prepare(main, n)
+        repeat = max(1, min(args.repeat, 30000 // max(n, 1)))
+        for stage in stages:
+            r = measure(STAGES[stage], main, data, memory=not args.no_memory, repeat=repeat)
+            results[stage][str(n)] = r
+            peak = f"{r['peak_kb']:10.1f}" if "peak_kb" in r else f"{'-':>10}"
+            print(f"{stage:<14} {n:>7} {r['items']:>7} {r['items_per_sec'] or 0:>11.1f} {peak}")
+
+    main.close_db()
+    tmp.cleanup()
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+    if args.baseline:
+        regressions = compare(results, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        for line in regressions:
+            print(f"[ERR] Regressione {line}")
+        if regressions:
+            return 1
+        print("[OK] Nessuna regressione rispetto alla baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
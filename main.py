@@ -1,18 +1,31 @@
+from __future__ import annotations
+
 import os
 import re
+import sys
 import time
+import json
 import hashlib
+import queue
+import random
 import sqlite3
+import threading
+import zlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import lru_cache
+from itertools import islice
 from io import BytesIO
-from urllib.parse import urlparse
-
-import feedparser
-import requests
-from bs4 import BeautifulSoup
+from typing import TYPE_CHECKING
+from urllib.parse import parse_qsl, urlencode, urljoin, urlparse
 
-from langdetect import detect
-from deep_translator import GoogleTranslator
-from telegram import Bot
+# feedparser, requests, bs4, langdetect, deep_translator e telegram sono
+# importati solo dentro le funzioni che li usano: l'import di main.py resta
+# leggero e gli helper si possono usare senza BOT_TOKEN
+if TYPE_CHECKING:
+    import requests
 
 # ======================
 # CONFIG
@@ -20,12 +33,116 @@ from telegram import Bot
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 CHANNEL = "@globalanimaladoptions"  # username del CANALE
 
+# Canali di pubblicazione: ognuno con le sue lingue e, se serve, i suoi filtri
+# di specie/paese (vuoti = tutto). La traduzione si fa una volta sola per le
+# lingue richieste da almeno un canale. Esempio:
+#   {"chat": "@adozioni_it", "languages": ("it",), "countries": {"IT"}},
+#   {"chat": "@cats_en", "languages": ("en",), "species": {"cat"}},
+CHANNELS = [
+    {"chat": CHANNEL, "languages": ("en", "it", "es", "fr", "de")},
+]
+
 # Filtri opzionali (lascia vuoti per pubblicare tutto)
 ALLOWED_SPECIES = set()     # es: {"dog", "cat"}
 ALLOWED_COUNTRIES = set()   # es: {"IT", "ES"}
 
 MAX_POSTS_PER_RUN = 3
 SLEEP_BETWEEN_POSTS_SEC = 1
+TELEGRAM_MAX_RETRIES = 3
+# Più foto dello stesso animale in un unico album (send_media_group, 2..10
+# elementi); la didascalia sta sul primo
+POST_ALBUMS = True
+ALBUM_MAX_IMAGES = 6
+# Limiti di Telegram (in unità UTF-16): i messaggi vengono accorciati già in
+# fase di composizione
+TELEGRAM_CAPTION_MAX = 1024
+TELEGRAM_TEXT_MAX = 4096
+
+# Download concorrente: thread totali e connessioni massime per host
+FETCH_WORKERS = 8
+FETCH_PER_HOST = 2
+FETCH_TIMEOUT_SEC = 30
+
+# Salute degli host: retry con jitter entro un budget per run, circuit breaker
+# dopo errori consecutivi (intervallo che raddoppia), timeout ricavato dalla
+# latenza osservata (tra FETCH_TIMEOUT_MIN_SEC e FETCH_TIMEOUT_SEC)
+FETCH_MAX_RETRIES = 2
+RETRY_BUDGET_PER_RUN = 10
+RETRY_BASE_SEC = 1.0
+RETRY_MAX_WAIT_SEC = 30
+BREAKER_FAILURES = 3
+BREAKER_BASE_SEC = 15 * 60
+BREAKER_MAX_SEC = 24 * 3600
+FETCH_TIMEOUT_MIN_SEC = 5
+TIMEOUT_LATENCY_FACTOR = 4
+
+# Immagini: prefetch in parallelo, limiti di Telegram per send_photo
+IMAGE_WORKERS = 4
+IMAGE_MAX_DOWNLOAD_BYTES = 20 * 1024 * 1024
+TELEGRAM_PHOTO_MAX_BYTES = 10 * 1024 * 1024
+IMAGE_MAX_SIDE = 2560
+IMAGE_BAD_TTL_SEC = 24 * 3600
+
+# Feed letti in streaming (XMLPullParser sul corpo della risposta): la lettura
+# si ferma dopo FEED_STALE_STREAK voci di fila già viste o più vecchie
+# dell'ultimo giro completo del feed
+FEED_STREAMING = True
+FEED_STALE_STREAK = 3
+FEED_CHUNK_BYTES = 16 * 1024
+
+# Parser HTML: "auto" sceglie selectolax, poi lxml, poi html.parser
+# (secondo cosa è installato); oppure uno dei tre esplicitamente
+HTML_PARSER = "auto"
+
+# Budget per `import main` (python main.py --startup-report)
+STARTUP_BUDGET_MS = 100
+
+# Report JSON di ogni run (tempi per fase, contatori per sorgente, latenze);
+# vuoto per disattivarlo
+RUN_REPORT_PATH = "run_report.json"
+
+# Cache traduzioni: vive in ads.db (committato), quindi è limitata in byte di
+# testo tradotto; le righe meno usate vengono eliminate. Le traduzioni dei post
+# pubblicati restano comunque nell'archivio
+TRANSLATION_CACHE_MAX_BYTES = 2 * 1024 * 1024
+TRANSLATION_TARGETS = ("it", "es", "fr", "de")
+
+# Lingua del testo: prima le indicazioni della sorgente (paese fisso, dominio),
+# poi langdetect con seme fisso solo sui primi caratteri
+LANG_DETECT_PREFIX_CHARS = 600
+LANG_MIN_CONFIDENCE = 0.7
+
+# Anti-duplicati: id binari da 16 byte, righe non più viste scadono
+AD_ID_BYTES = 16
+SEEN_RETENTION_DAYS = 365
+
+# Archivio degli annunci pubblicati: testi compressi con zlib, ricerca FTS5.
+# Sta in un file a parte, non committato (su Actions passa da un run all'altro
+# con actions/cache): ads.db resta piccolo
+ARCHIVE_DB_PATH = "archive.db"
+ARCHIVE_RETENTION_DAYS = 365
+ARCHIVE_ZLIB_LEVEL = 6
+ARCHIVE_SEARCH_LIMIT = 20
+
+# Esecuzione a shard (--shards N): N processi scaricano, filtrano e traducono
+# ognuno le sorgenti dei propri host e scrivono nell'outbox; un solo publisher
+# la svuota verso Telegram con il ritmo di SLEEP_BETWEEN_POSTS_SEC
+LEASE_TTL_SEC = 6 * 3600         # annuncio preso da un processo: scade se il processo muore
+PUBLISHER_LEASE_SEC = 30 * 60
+OUTBOX_MAX_PENDING = 50          # outbox piena: gli shard non producono altro
+
+# Quasi-duplicati (stesso animale su più siti): SimHash a 64 bit di titolo e
+# descrizione, diviso in bande per la ricerca; testi troppo corti non si confrontano
+SIMHASH_MAX_DISTANCE = 5
+SIMHASH_BANDS = 6               # deve essere > SIMHASH_MAX_DISTANCE
+NEAR_DUP_MIN_TOKENS = 8
+
+# Scheduler: sorgenti scaricate per run e backoff per quelle che non rendono
+SOURCES_PER_RUN = 12
+SCHEDULER_MIN_RATE = 0.05       # rendimento minimo: anche le sorgenti "secche" tornano in giro
+SCHEDULER_EWMA_ALPHA = 0.3
+SCHEDULER_BACKOFF_BASE_SEC = 10 * 60
+SCHEDULER_BACKOFF_MAX_SEC = 6 * 3600
 
 FEEDS = [
     "https://www.rspca.org.uk/adopt-pets/feed",
@@ -55,7 +172,7 @@ SCRAPE_SOURCES = [
     ("https://www.rifugioapachioggia.it/adotta-un-micio", "cat", "IT"),
      ("https://www.adotta.me/animali", None, "IT"),
     ("https://www.adoptapet.com/dog-adoption", "dog", "EN"),
-    ("https://www.adoptapet.com/adoptable-pets/rss", "cat", "EN"),
+    ("https://www.adoptapet.com/cat-adoption", "cat", "EN"),
     ("https://www.adoptapet.com/other-pet-adoption", None, "EN"),
     ("https://www.petfinder.com/search/dogs-for-adoption/", "dog", "EN"),
     ("https://www.petfinder.com/search/cats-for-adoption/", "cat", "EN"),
@@ -92,42 +209,512 @@ UA_HEADERS = {
 }
 
 # ======================
-# BOT + DB
+# RUN REPORT
 # ======================
-if not BOT_TOKEN:
-    raise RuntimeError("BOT_TOKEN non trovato. Imposta il secret BOT_TOKEN su GitHub Actions.")
+class RunStats:
+    # aggiornato da tutti i thread del run. I secondi di una fase sono sommati
+    # sui thread: fetch e immagini girano in parallelo e possono superare il
+    # tempo totale del run
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.started = time.time()
+        self.t0 = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self.latencies = {}
+        self.sources = {}
+
+    @contextmanager
+    def timer(self, stage: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t0
+            with self.lock:
+                s = self.stages.setdefault(stage, {"calls": 0, "seconds": 0.0})
+                s["calls"] += 1
+                s["seconds"] += elapsed
+
+    def incr(self, name: str, n: int = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def source(self, url: str, name: str, n: float = 1) -> None:
+        with self.lock:
+            counters = self.sources.setdefault(url, {})
+            counters[name] = counters.get(name, 0) + n
+
+    def latency(self, name: str, seconds: float) -> None:
+        with self.lock:
+            self.latencies.setdefault(name, []).append(seconds)
+
+    def report(self) -> dict:
+        def summary(values):
+            v = sorted(values)
+            pick = lambda q: round(v[min(len(v) - 1, int(q * len(v)))] * 1000, 1)
+            return {
+                "count": len(v),
+                "mean_ms": round(sum(v) / len(v) * 1000, 1),
+                "p50_ms": pick(0.5),
+                "p95_ms": pick(0.95),
+                "max_ms": round(v[-1] * 1000, 1),
+            }
+
+        with self.lock:
+            sources = {}
+            for url, c in self.sources.items():
+                c = dict(c)
+                # scartati dal filtro adozioni / specie / paese
+                c["filtered"] = c.get("examined", 0) - c.get("deduped", 0) - c.get("candidates", 0)
+                sources[url] = c
+            return {
+                "started": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.started)),
+                "wall_seconds": round(time.perf_counter() - self.t0, 3),
+                "stages": {k: {"calls": v["calls"], "seconds": round(v["seconds"], 3)} for k, v in self.stages.items()},
+                "counters": dict(self.counters),
+                "latency": {k: summary(v) for k, v in self.latencies.items() if v},
+                "sources": sources,
+            }
+
+    def write(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2, ensure_ascii=False)
+
+stats = RunStats()
 
-bot = Bot(BOT_TOKEN)
+# ======================
+# DB
+# ======================
+DB_PATH = "ads.db"
+_db_local = threading.local()
+
+def db() -> sqlite3.Connection:
+    # una connessione per thread (sqlite3 non condivide le connessioni)
+    c = getattr(_db_local, "conn", None)
+    if c is None:
+        c = sqlite3.connect(DB_PATH, timeout=30)
+        # WAL: letture e scritture non si bloccano; alla chiusura il WAL viene
+        # riversato in ads.db, quindi il file committato resta autosufficiente
+        c.execute("PRAGMA journal_mode=WAL")
+        c.execute("PRAGMA synchronous=NORMAL")
+        _db_local.conn = c
+    return c
+
+def archive_db() -> sqlite3.Connection:
+    # come db(), sul file dell'archivio; tabelle create alla prima connessione
+    c = getattr(_db_local, "archive", None)
+    if c is None:
+        c = sqlite3.connect(ARCHIVE_DB_PATH, timeout=30)
+        c.execute("PRAGMA journal_mode=WAL")
+        c.execute("PRAGMA synchronous=NORMAL")
+        init_archive_db(c)
+        _db_local.archive = c
+    return c
+
+def close_db() -> None:
+    for name in ("conn", "archive"):
+        c = getattr(_db_local, name, None)
+        if c is not None:
+            c.close()
+            setattr(_db_local, name, None)
+
+def init_db() -> None:
+    conn = db()
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS seen_ads (
+        id BLOB PRIMARY KEY,
+        url TEXT,
+        first_seen INTEGER,
+        last_seen INTEGER
+    ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS seen_ads_last_seen ON seen_ads(last_seen)")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS simhash_bands (
+        band INTEGER,
+        bucket INTEGER,
+        ad_id BLOB,
+        simhash INTEGER,
+        PRIMARY KEY (band, bucket, ad_id)
+    ) WITHOUT ROWID
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS http_cache (
+        url TEXT PRIMARY KEY,
+        etag TEXT,
+        last_modified TEXT,
+        content_hash TEXT
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS translations (
+        text_hash TEXT,
+        source TEXT,
+        target TEXT,
+        translated TEXT,
+        last_used INTEGER,
+        PRIMARY KEY (text_hash, source, target)
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS translations_last_used ON translations(last_used)")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS images (
+        url TEXT PRIMARY KEY,
+        content_hash TEXT,
+        bad_until INTEGER
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS image_files (
+        content_hash TEXT PRIMARY KEY,
+        file_id TEXT
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS source_state (
+        url TEXT PRIMARY KEY,
+        last_fetched INTEGER,
+        fetches INTEGER,
+        yields INTEGER,
+        yield_rate REAL,
+        empty_streak INTEGER,
+        backoff_until INTEGER,
+        cursor INTEGER,
+        cursor_hash TEXT,
+        high_water REAL
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS host_health (
+        host TEXT PRIMARY KEY,
+        failures INTEGER,
+        open_until INTEGER,
+        latency REAL
+    )
+    """)
+    # annunci (id) e ruoli (b"publisher") presi da un processo fino a expires
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS leases (
+        key BLOB PRIMARY KEY,
+        owner TEXT,
+        expires REAL
+    )
+    """)
+    # annunci tradotti dagli shard in attesa del publisher
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY,
+        ad_id BLOB UNIQUE,
+        created INTEGER,
+        payload BLOB
+    )
+    """)
+    # DB creati prima dell'high-water mark dei feed
+    if "high_water" not in {row[1] for row in conn.execute("PRAGMA table_info(source_state)")}:
+        conn.execute("ALTER TABLE source_state ADD COLUMN high_water REAL")
+    conn.commit()
+    migrate_legacy_ads()
+    migrate_archive()
+
+def init_archive_db(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS archive (
+        id INTEGER PRIMARY KEY,
+        ad_id BLOB UNIQUE,
+        posted INTEGER,
+        source TEXT,
+        url TEXT,
+        title TEXT,
+        species TEXT,
+        country TEXT,
+        lang TEXT,
+        raw_hash TEXT,
+        body BLOB
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS archive_filter ON archive(species, country, posted)")
+    conn.execute("CREATE INDEX IF NOT EXISTS archive_posted ON archive(posted)")
+    conn.execute("CREATE INDEX IF NOT EXISTS archive_raw_hash ON archive(raw_hash)")
+    # indice full-text senza copia del testo (contentless): il testo sta solo
+    # compresso in archive.body
+    conn.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS archive_fts USING fts5(
+        title, text, content='', tokenize='unicode61 remove_diacritics 2'
+    )
+    """)
+    conn.commit()
 
-conn = sqlite3.connect("ads.db")
-cur = conn.cursor()
-cur.execute("""
-CREATE TABLE IF NOT EXISTS ads (
-    id TEXT PRIMARY KEY,
-    url TEXT
-)
-""")
-conn.commit()
+def migrate_archive() -> None:
+    # archivio creato dentro ads.db dalle versioni precedenti: passa nel suo file
+    conn = db()
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name='archive'").fetchone():
+        return
+    rows = conn.execute("SELECT * FROM archive ORDER BY id").fetchall()
+    adb = archive_db()
+    with adb:
+        for row in rows:
+            cur = adb.execute("INSERT OR IGNORE INTO archive VALUES (NULL,?,?,?,?,?,?,?,?,?,?)", row[1:])
+            if cur.rowcount:
+                adb.execute(
+                    "INSERT INTO archive_fts(rowid, title, text) VALUES (?,?,?)",
+                    (cur.lastrowid, row[5], archive_fts_text(archive_body(row[-1]))),
+                )
+    with conn:
+        conn.execute("DROP TABLE IF EXISTS archive_fts")
+        conn.execute("DROP TABLE archive")
+    conn.execute("VACUUM")
+    print(f"[OK] Archivio spostato in {ARCHIVE_DB_PATH}: {len(rows)} annunci")
+
+def migrate_legacy_ads() -> None:
+    # vecchia tabella ads(id hex, url) -> seen_ads(id 16 byte, timestamp)
+    conn = db()
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='ads'").fetchone() is None:
+        return
+    now = int(time.time())
+    rows = [(bytes.fromhex(i)[:AD_ID_BYTES], u, now, now) for i, u in conn.execute("SELECT id, url FROM ads")]
+    conn.executemany("INSERT OR IGNORE INTO seen_ads VALUES (?,?,?,?)", rows)
+    conn.execute("DROP TABLE ads")
+    conn.commit()
+    conn.execute("VACUUM")
+    print(f"[OK] Migrati {len(rows)} annunci in seen_ads")
+
+class SeenStore:
+    # tutti gli id in memoria con una sola query, scritture in un'unica
+    # transazione a fine run
+    def __init__(self, conn):
+        self.conn = conn
+        self.ids = {row[0] for row in conn.execute("SELECT id FROM seen_ads")}
+        self.new = {}
+        self.touched = set()
+
+    def __contains__(self, ad_id: bytes) -> bool:
+        if ad_id in self.ids:
+            self.touched.add(ad_id)
+            return True
+        return ad_id in self.new
+
+    def add(self, ad_id: bytes, url: str) -> None:
+        self.new[ad_id] = url
+
+    def flush(self) -> None:
+        now = int(time.time())
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO seen_ads VALUES (?,?,?,?)",
+                [(i, u, now, now) for i, u in self.new.items()],
+            )
+            self.conn.executemany(
+                "UPDATE seen_ads SET last_seen=? WHERE id=?",
+                [(now, i) for i in self.touched],
+            )
+        self.ids.update(self.new)
+        self.new.clear()
+        self.touched.clear()
+
+    def expire(self, days: int) -> int:
+        # annunci non più incontrati da `days` giorni: la sorgente li ha rimossi
+        with self.conn:
+            n = self.conn.execute(
+                "DELETE FROM seen_ads WHERE last_seen < ?", (int(time.time()) - days * 86400,)
+            ).rowcount
+        return n
+
+def make_ad_id(*parts: str) -> bytes:
+    return hashlib.sha256("|".join(parts).encode()).digest()[:AD_ID_BYTES]
+
+def take_lease(key: bytes, owner: str, ttl: float) -> bool:
+    # vince il primo processo; una lease scaduta (processo morto) si può riprendere
+    now = time.time()
+    conn = db()
+    with conn:
+        cur = conn.execute(
+            "INSERT INTO leases VALUES (?,?,?) ON CONFLICT(key) DO UPDATE "
+            "SET owner=excluded.owner, expires=excluded.expires "
+            "WHERE leases.expires < ? OR leases.owner = excluded.owner",
+            (key, owner, now + ttl, now),
+        )
+    return cur.rowcount > 0
+
+def release_leases(owner: str) -> None:
+    # quelle degli annunci ancora in outbox passano al publisher
+    conn = db()
+    with conn:
+        conn.execute(
+            "DELETE FROM leases WHERE owner=? AND key NOT IN (SELECT ad_id FROM outbox)", (owner,)
+        )
 
-def already_sent(ad_id: str) -> bool:
-    cur.execute("SELECT 1 FROM ads WHERE id=?", (ad_id,))
-    return cur.fetchone() is not None
+# ======================
+# QUASI-DUPLICATI (SimHash)
+# ======================
+SIMHASH_TOKEN_RE = re.compile(r"\w{2,}")
+SIMHASH_MASK = (1 << 64) - 1
+# bande di 64 // SIMHASH_BANDS bit, le prime con un bit in più se avanza
+SIMHASH_BAND_SPANS = [
+    (sum(64 // SIMHASH_BANDS + (j < 64 % SIMHASH_BANDS) for j in range(b)),
+     64 // SIMHASH_BANDS + (b < 64 % SIMHASH_BANDS))
+    for b in range(SIMHASH_BANDS)
+]
 
-def save_ad(ad_id: str, url: str) -> None:
-    cur.execute("INSERT INTO ads VALUES (?,?)", (ad_id, url))
-    conn.commit()
+def simhash(text: str) -> int | None:
+    # parole e coppie di parole consecutive, pesate per frequenza
+    tokens = SIMHASH_TOKEN_RE.findall(text.lower())
+    if len(tokens) < NEAR_DUP_MIN_TOKENS:
+        return None
+    weights = {}
+    for f in tokens + [a + " " + b for a, b in zip(tokens, tokens[1:])]:
+        weights[f] = weights.get(f, 0) + 1
+    v = [0] * 64
+    for f, w in weights.items():
+        h = int.from_bytes(hashlib.blake2b(f.encode(), digest_size=8).digest(), "big")
+        for bit in range(64):
+            v[bit] += w if h >> bit & 1 else -w
+    return sum(1 << bit for bit in range(64) if v[bit] > 0)
+
+def simhash_bands(fp: int) -> list:
+    # distanza <= SIMHASH_MAX_DISTANCE < SIMHASH_BANDS: almeno una banda è identica
+    return [(b, fp >> shift & ((1 << width) - 1)) for b, (shift, width) in enumerate(SIMHASH_BAND_SPANS)]
+
+def hamming(a: int, b: int) -> int:
+    return bin((a ^ b) & SIMHASH_MASK).count("1")
+
+class NearDupIndex:
+    # impronte degli annunci pubblicati, cercate per banda in sqlite; quelle
+    # prese in questo run restano in memoria finché non vengono salvate
+    def __init__(self, conn):
+        self.conn = conn
+        self.run = {}
+        self.new = {}
+
+    def find(self, fp: int) -> bool:
+        for band, bucket in simhash_bands(fp):
+            for other in self.run.get((band, bucket), ()):
+                if hamming(fp, other) <= SIMHASH_MAX_DISTANCE:
+                    return True
+            for (other,) in self.conn.execute(
+                "SELECT simhash FROM simhash_bands WHERE band=? AND bucket=?", (band, bucket)
+            ):
+                if hamming(fp, other) <= SIMHASH_MAX_DISTANCE:
+                    return True
+        return False
+
+    def claim(self, fp: int) -> None:
+        for key in simhash_bands(fp):
+            self.run.setdefault(key, []).append(fp)
+
+    def add(self, ad_id: bytes, fp: int) -> None:
+        self.new[ad_id] = fp
+
+    def flush(self) -> None:
+        # sqlite ha interi con segno a 64 bit
+        rows = [
+            (band, bucket, ad_id, fp - (1 << 64) if fp >> 63 else fp)
+            for ad_id, fp in self.new.items()
+            for band, bucket in simhash_bands(fp)
+        ]
+        with self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO simhash_bands VALUES (?,?,?,?)", rows)
+        self.new.clear()
+
+    def expire(self) -> int:
+        # segue la scadenza di seen_ads
+        with self.conn:
+            n = self.conn.execute(
+                "DELETE FROM simhash_bands WHERE ad_id NOT IN (SELECT id FROM seen_ads)"
+            ).rowcount
+        return n
+
+# ======================
+# HTTP CACHE (ETag / Last-Modified)
+# ======================
+def http_cache_get(url: str):
+    return db().execute("SELECT etag, last_modified, content_hash FROM http_cache WHERE url=?", (url,)).fetchone()
+
+def conditional_headers(url: str) -> dict:
+    row = http_cache_get(url)
+    if not row:
+        return {}
+    etag, last_modified, _ = row
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    return headers
+
+def content_hash(r) -> str:
+    return hashlib.sha256(r.content).hexdigest()
+
+def not_modified(url: str, r, page_hash: str | None) -> bool:
+    # page_hash è None per le risposte lette in streaming: conta solo il 304
+    if r.status_code == 304:
+        return True
+    row = http_cache_get(url)
+    return bool(page_hash and row and row[2] == page_hash)
+
+def http_cache_store(url: str, r, page_hash: str | None) -> None:
+    # da chiamare solo dopo aver elaborato tutta la sorgente, altrimenti
+    # gli annunci non ancora visti resterebbero saltati al giro dopo
+    if r.status_code != 200:
+        return
+    c = db()
+    c.execute(
+        "INSERT OR REPLACE INTO http_cache VALUES (?,?,?,?)",
+        (url, r.headers.get("ETag"), r.headers.get("Last-Modified"), page_hash),
+    )
+    c.commit()
 
 # ======================
 # CLEANING / WP footer
 # ======================
 IMG_RE = re.compile(r'<img[^>]+src=["\']([^"\']+)["\']', re.I)
+# solo tag veri (<p>, </a>, <br/>, <!doctype>), con attributi tra virgolette
+# senza < o > dentro: tutto il resto passa dal parser
+TAG_RE = re.compile(r"""<[A-Za-z/!](?:[^<>"']|"[^"<>]*"|'[^'<>]*')*>""")
+WS_RE = re.compile(r"\s+")
+# markup che il fast path a regex non sa togliere: serve un parser vero
+NEEDS_PARSER_RE = re.compile(r"<(?:script|style|textarea|!--|!\[CDATA\[)", re.I)
+
+def _installed(module: str) -> bool:
+    import importlib.util
+    return importlib.util.find_spec(module) is not None
+
+@lru_cache(maxsize=None)
+def page_backend() -> str:
+    if HTML_PARSER != "auto":
+        return HTML_PARSER
+    for backend in ("selectolax", "lxml"):
+        if _installed(backend):
+            return backend
+    return "html.parser"
+
+@lru_cache(maxsize=None)
+def bs4_parser() -> str:
+    # BeautifulSoup non parla selectolax: lxml se c'è
+    backend = page_backend()
+    if backend == "selectolax":
+        return "lxml" if _installed("lxml") else "html.parser"
+    return backend
 
 def clean_html(html: str) -> str:
     if not html:
         return ""
-    soup = BeautifulSoup(html, "html.parser")
-    text = soup.get_text(" ", strip=True)
-    text = re.sub(r"\s+", " ", text).strip()
+    import html as htmllib
+
+    if "<" not in html:
+        text = htmllib.unescape(html) if "&" in html else html
+    elif not NEEDS_PARSER_RE.search(html) and "<" not in (stripped := TAG_RE.sub(" ", html)):
+        # summary dei feed: quasi solo testo con <p>/<a>/<br>/<img>; un "<"
+        # rimasto ("<3", attributo strano) vuol dire che serve il parser
+        text = htmllib.unescape(stripped)
+    else:
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(html, bs4_parser())
+        text = soup.get_text(" ", strip=True)
+    text = WS_RE.sub(" ", text).strip()
     return text
 
 def remove_wp_footer(text: str) -> str:
@@ -151,23 +738,131 @@ def remove_wp_footer(text: str) -> str:
 # ======================
 # TRANSLATION
 # ======================
-def translate_all(text: str):
-    text = (text or "").strip()
-    if not text:
-        return "", "", "", "", "", "en"
+_translate_pool = None
+_translate_pool_lock = threading.Lock()
+
+def translate_pool() -> ThreadPoolExecutor:
+    global _translate_pool
+    with _translate_pool_lock:
+        if _translate_pool is None:
+            _translate_pool = ThreadPoolExecutor(max_workers=len(TRANSLATION_TARGETS))
+        return _translate_pool
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+def translation_cache_get(text: str, source: str, target: str):
+    key = (text_hash(text), source, target)
+    row = db().execute("SELECT translated FROM translations WHERE text_hash=? AND source=? AND target=?", key).fetchone()
+    if row is None:
+        return None
+    db().execute(
+        "UPDATE translations SET last_used=? WHERE text_hash=? AND source=? AND target=?",
+        (int(time.time()), *key),
+    )
+    return row[0]
+
+def translation_cache_put(text: str, source: str, target: str, translated: str) -> None:
+    db().execute(
+        "INSERT OR REPLACE INTO translations VALUES (?,?,?,?,?)",
+        (text_hash(text), source, target, translated, int(time.time())),
+    )
+
+def trim_translation_cache() -> None:
+    # LRU: tiene le righe usate più di recente finché il testo tradotto sta
+    # in TRANSLATION_CACHE_MAX_BYTES
+    c = db()
+    deleted = c.execute("""
+        DELETE FROM translations WHERE rowid IN (
+            SELECT rowid FROM (
+                SELECT rowid, SUM(length(CAST(translated AS BLOB)))
+                    OVER (ORDER BY last_used DESC, rowid DESC) AS total
+                FROM translations
+            ) WHERE total > ?
+        )
+    """, (TRANSLATION_CACHE_MAX_BYTES,)).rowcount
+    c.commit()
+    # dopo un taglio grosso (es. cache vecchia senza limite) compatta il file,
+    # altrimenti le pagine libere restano nel DB committato
+    free = c.execute("PRAGMA freelist_count").fetchone()[0]
+    pages = c.execute("PRAGMA page_count").fetchone()[0]
+    if deleted and free * 2 > pages:
+        c.execute("VACUUM")
+
+def translator_call(translator, text: str) -> str:
+    t0 = time.perf_counter()
+    try:
+        return translator.translate(text)
+    except Exception:
+        stats.incr("translator_errors")
+        raise
+    finally:
+        stats.latency("translator", time.perf_counter() - t0)
 
+def translate_many(text: str, source: str, targets) -> dict:
+    from deep_translator import GoogleTranslator
+
+    # cache in questo thread (sqlite), solo le chiamate HTTP in parallelo
+    out, pending = {}, {}
+    for t in targets:
+        if t == source:
+            out[t] = text
+            continue
+        cached = translation_cache_get(text, source, t)
+        if cached is not None:
+            out[t] = cached
+            stats.incr("translation_cache_hits")
+        else:
+            pending[t] = translate_pool().submit(translator_call, GoogleTranslator(source=source, target=t), text)
+    for t, fut in pending.items():
+        out[t] = fut.result()
+        translation_cache_put(text, source, t, out[t])
+    db().commit()
+    return out
+
+Language = namedtuple("Language", "code confidence method")
+
+@lru_cache(maxsize=4096)
+def detect_language(prefix: str) -> Language:
+    # seme fisso: stesso testo, stessa lingua (e stesse chiavi di cache) a ogni run
+    from langdetect import DetectorFactory, detect_langs
+
+    DetectorFactory.seed = 0
     try:
-        lang = detect(text)
+        best = detect_langs(prefix)[0]
     except Exception:
-        lang = "en"
+        return Language("en", 0.0, "default")
+    return Language(best.lang, round(best.prob, 3), "detect")
 
-    en = GoogleTranslator(source=lang, target="en").translate(text)
-    it = GoogleTranslator(source="en", target="it").translate(en)
-    es = GoogleTranslator(source="en", target="es").translate(en)
-    fr = GoogleTranslator(source="en", target="fr").translate(en)
-    de = GoogleTranslator(source="en", target="de").translate(en)
+def text_language(text: str, hint: str | None = None) -> Language:
+    if hint:
+        return Language(hint, 1.0, "hint")
+    text = (text or "").strip()
+    if not text:
+        return Language("en", 0.0, "default")
+    return detect_language(text[:LANG_DETECT_PREFIX_CHARS])
 
-    return en, it, es, fr, de, lang
+def translate_for(text: str, lang: str, languages) -> dict:
+    # inglese come lingua ponte; se la lingua originale è tra le destinazioni
+    # si usa il testo originale
+    text = (text or "").strip()
+    if not text:
+        return {l: "" for l in languages}
+    en = translate_many(text, lang, ["en"])["en"]
+    direct = {t: text for t in languages if t == lang}
+    out = translate_many(en, "en", [t for t in languages if t not in direct and t != "en"])
+    out.update(direct)
+    out["en"] = en
+    return out
+
+def translate_all(text: str, lang: str | None = None):
+    text = (text or "").strip()
+    if not text:
+        return "", "", "", "", "", "en"
+
+    lang = lang or text_language(text).code
+    out = translate_for(text, lang, TRANSLATION_TARGETS)
+    return out["en"], out["it"], out["es"], out["fr"], out["de"], lang
 
 # ======================
 # ADOPTION FILTER (anti blog/news)
@@ -190,22 +885,24 @@ ADOPTION_NEGATIVE = [
     # EN
     "blog", "post", "newsletter", "update", "announcement", "press", "donate", "fundraiser", "event",
     "we've been working", "release", "version",
+    "blogs", "posts", "newsletters", "updates", "announcements", "fundraisers", "events", "releases", "versions",
     # IT
     "blog", "articolo", "post", "newsletter", "aggiornamento", "comunicato", "evento", "raccolta fondi", "donazione",
     "stiamo lavorando", "versione",
     # ES
     "blog", "artículo", "publicación", "boletín", "actualización", "evento", "recaudación", "donación",
     "hemos estado trabajando", "versión",
+    "blogs", "artículos", "publicaciones", "boletines", "actualizaciones", "eventos", "donaciones", "versiones",
     # FR 
     "blog", "article", "publication", "bulletin", "actualité", "mise à jour", "communiqué", "événement", "don", "collecte de fonds", "nous travaillons", "version",
+    "blogs", "articles", "publications", "bulletins", "actualités", "communiqués", "événements", "dons", "versions",
     # DE 
     "blog", "artikel", "beitrag", "newsletter", "aktualisierung", "ankündigung", "presse", "veranstaltung", "spende", "spendenaktion", "wir arbeiten", "version",
 ]
 
 def looks_like_adoption(title: str, text: str) -> bool:
-    hay = f"{title} {text}".lower()
-    pos = sum(1 for k in ADOPTION_POSITIVE if k in hay)
-    neg = sum(1 for k in ADOPTION_NEGATIVE if k in hay)
+    hits = scan_keywords(f"{title} {text}".lower())
+    pos, neg = hits.pos, hits.neg
 
     # chiaramente news/blog
     if neg >= 2 and pos == 0:
@@ -218,20 +915,23 @@ def looks_like_adoption(title: str, text: str) -> bool:
 # ======================
 # SPECIES + COUNTRY
 # ======================
+# il matcher confronta parole intere: i plurali (dogs, gatos, Katzen, ...)
+# vanno elencati
 SPECIES_KEYWORDS = {
-    "dog": ["dog", "puppy", "cane", "cucciolo", "perro", "cachorro", "chien", "chiot", "hund", "welpe"],
-    "cat": ["cat", "kitten", "gatto", "gattino", "gato", "chat", "chaton", "katze", "kätzchen"],
-    "rabbit": ["rabbit", "coniglio", "conejo", "lapin", "kaninchen"],
-    "bird": ["bird", "uccello", "ave", "pájaro", "oiseau", "vogel"],
-    "horse": ["horse", "cavallo", "caballo", "cheval", "pferd"],
-    "guinea_pig": [ "guinea pig", "guinea-pig", "cavia", "porcellino d india", "porcellino d'india", "cobaye", "meerschweinchen" ],
-    "rodent": [ "rodent", "criceto", "hamster", "topo", "ratto", "rattus", "mouse", "mice", "rat" ],
-    "barnyard": [ "barnyard", "farm animal", "fattoria", "animali da fattoria", "mucca", "cow", "capra", "goat", "pecora", "sheep", "maiale", "pig", "asino", "donkey" ],
-    "reptile": [ "reptile", "rettile", "serpente", "snake", "lucertola", "lizard", "tartaruga", "turtle", "tortoise", "geco", "gecko" ],
-    "fish": [ "fish", "pesce", "pez", "poisson", "fisch" ],
-    "ferret": [ "ferret", "furetto", "furet", "iltis" ],
-    "other": [ "other pet", "altro animale", "misc", "various" ],
-    None: ["dog", "puppy", "cane", "cucciolo", "perro", "cachorro", "chien", "chiot", "hund", "welpe","cat", "kitten", "gatto", "gattino", "gato", "chat", "chaton", "katze", "kätzchen", "rabbit", "coniglio", "conejo", "lapin", "kaninchen", "bird", "uccello", "ave", "pájaro", "oiseau", "vogel", "guinea pig", "guinea-pig", "cavia", "porcellino d india", "porcellino d'india", "cobaye", "meerschweinchen", "rodent", "criceto", "hamster", "topo", "ratto", "rattus", "mouse", "mice", "rat","barnyard", "farm animal", "fattoria", "animali da fattoria", "mucca", "cow", "capra", "goat", "pecora", "sheep", "maiale", "pig", "asino", "donkey","reptile", "rettile", "serpente", "snake", "lucertola", "lizard", "tartaruga", "turtle", "tortoise", "geco", "gecko","fish", "pesce", "pez", "poisson", "fisch", "ferret", "furetto", "furet", "iltis", "other pet", "altro animale", "misc", "various"]
+    "dog": ["dog", "puppy", "puppies", "cane", "cucciolo", "perro", "cachorro", "chien", "chiot", "hund", "hunde", "hunden", "welpe", "welpen", "dogs", "perros", "cachorros", "chiens", "chiots"],
+    "cat": ["cat", "kitten", "gatto", "gattino", "gato", "chat", "chaton", "katze", "katzen", "kätzchen", "cats", "kittens", "gatos", "gatitos", "chats", "chatons"],
+    "rabbit": ["rabbit", "coniglio", "conejo", "lapin", "kaninchen", "rabbits", "conejos", "lapins"],
+    "bird": ["bird", "uccello", "ave", "pájaro", "oiseau", "vogel", "birds", "aves", "pájaros", "oiseaux", "vögel"],
+    "horse": ["horse", "cavallo", "caballo", "cheval", "pferd", "pferde", "pferden", "horses", "caballos", "chevaux"],
+    "guinea_pig": [ "guinea pig", "guinea-pig", "cavia", "porcellino d india", "porcellino d'india", "cobaye", "meerschweinchen", "guinea pigs", "guinea-pigs", "cobayes" ],
+    "rodent": [ "rodent", "criceto", "hamster", "topo", "ratto", "rattus", "mouse", "mice", "rat", "rodents", "hamsters", "rats" ],
+    "barnyard": [ "barnyard", "farm animal", "fattoria", "animali da fattoria", "mucca", "cow", "capra", "goat", "pecora", "sheep", "maiale", "pig", "asino", "donkey", "farm animals", "cows", "goats", "pigs", "donkeys" ],
+    "reptile": [ "reptile", "rettile", "serpente", "snake", "lucertola", "lizard", "tartaruga", "turtle", "tortoise", "geco", "gecko", "reptiles", "snakes", "lizards", "turtles", "tortoises", "geckos" ],
+    "fish": [ "fish", "pesce", "pez", "poisson", "fisch", "fische", "fischen", "fishes", "peces", "poissons" ],
+    "ferret": [ "ferret", "furetto", "furet", "iltis", "ferrets", "furets" ],
+    "other": [ "other pet", "altro animale", "misc", "various", "other pets" ],
+    # lista riassuntiva: il matcher usa solo le specie sopra
+    None: ["dog", "puppy", "cane", "cucciolo", "perro", "cachorro", "chien", "chiot", "hund", "hunde", "hunden", "welpe", "welpen", "puppies","cat", "kitten", "gatto", "gattino", "gato", "chat", "chaton", "katze", "katzen", "kätzchen", "rabbit", "coniglio", "conejo", "lapin", "kaninchen", "bird", "uccello", "ave", "pájaro", "oiseau", "vogel", "guinea pig", "guinea-pig", "cavia", "porcellino d india", "porcellino d'india", "cobaye", "meerschweinchen", "rodent", "criceto", "hamster", "topo", "ratto", "rattus", "mouse", "mice", "rat","barnyard", "farm animal", "fattoria", "animali da fattoria", "mucca", "cow", "capra", "goat", "pecora", "sheep", "maiale", "pig", "asino", "donkey","reptile", "rettile", "serpente", "snake", "lucertola", "lizard", "tartaruga", "turtle", "tortoise", "geco", "gecko","fish", "pesce", "pez", "poisson", "fisch", "fische", "fischen", "ferret", "furetto", "furet", "iltis", "other pet", "altro animale", "misc", "various", "dogs", "perros", "cachorros", "chiens", "chiots", "cats", "kittens", "gatos", "gatitos", "chats", "chatons", "rabbits", "conejos", "lapins", "birds", "aves", "pájaros", "oiseaux", "vögel", "horses", "caballos", "chevaux", "guinea pigs", "guinea-pigs", "cobayes", "rodents", "hamsters", "rats", "farm animals", "cows", "goats", "pigs", "donkeys", "reptiles", "snakes", "lizards", "turtles", "tortoises", "geckos", "fishes", "peces", "poissons", "ferrets", "furets", "other pets"]
 }
 
 DOMAIN_HINTS = [
@@ -259,13 +959,92 @@ DOMAIN_HINTS = [
 
 TLD_TO_COUNTRY = {"it": "IT", "es": "ES", "fr": "FR", "uk": "UK", "de": "DE", "mx": "MX", "au": "AU", "br": "BR"}
 
-def detect_species(title: str, text: str, default: str = "other") -> str:
-    hay = f"{title} {text}".lower()
-    for sp, kws in SPECIES_KEYWORDS.items():
+# lingua dei testi per paese della sorgente ("EN" è il paese generico di
+# SCRAPE_SOURCES per i siti in inglese); LANG_HINTS vince per prefisso di url
+COUNTRY_LANG = {
+    "IT": "it", "ES": "es", "MX": "es", "FR": "fr", "DE": "de", "BR": "pt",
+    "UK": "en", "US": "en", "USA": "en", "AU": "en", "EN": "en",
+}
+LANG_HINTS = [
+    ("oipa.org/international", "en"),
+]
+
+def language_hint(url: str, country: str | None) -> str | None:
+    for prefix, lang in LANG_HINTS:
+        if prefix in url:
+            return lang
+    # i codici regionali (USA-NYC, USA-LA...) valgono come il paese
+    return COUNTRY_LANG.get((country or detect_country(url) or "").split("-")[0])
+
+# ======================
+# KEYWORD MATCHER
+# ======================
+# Tutti i vocabolari compilati una volta sola in un'unica regex a trie:
+# una passata lineare sul testo restituisce conteggi e specie.
+# - parole positive: prefisso a inizio parola ("adotta" -> "adottami")
+# - negative e specie: parola intera, plurali elencati nei vocabolari
+#   ("cat" non prende "education", "rat" non prende "rates")
+KeywordHits = namedtuple("KeywordHits", "pos neg species")
+
+def _trie_pattern(words) -> str:
+    trie = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def walk(node) -> str:
+        branches = [re.escape(ch) + walk(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return walk(trie)
+
+def _build_keyword_matcher():
+    stems = {kw.lower() for kw in ADOPTION_POSITIVE}
+    words = {}
+    for kw in ADOPTION_NEGATIVE:
+        words.setdefault(kw.lower(), set()).add("neg")
+    # l'ordine del dizionario resta la priorità tra specie
+    species_rank = {}
+    for rank, (sp, kws) in enumerate((sp, kws) for sp, kws in SPECIES_KEYWORDS.items() if sp):
         for kw in kws:
-            if kw in hay:
-                return sp
-    return default
+            kw = kw.lower()
+            if kw not in species_rank or species_rank[kw][0] > rank:
+                species_rank[kw] = (rank, sp)
+            words.setdefault(kw, set()).add("species")
+    pattern = (
+        rf"(?<!\w)(?:(?P<stem>{_trie_pattern(stems)})"
+        rf"|(?P<word>{_trie_pattern(words)})(?!\w))"
+    )
+    return re.compile(pattern), words, species_rank
+
+KEYWORD_RE, KEYWORD_KINDS, SPECIES_RANK = _build_keyword_matcher()
+
+@lru_cache(maxsize=256)
+def scan_keywords(hay: str) -> KeywordHits:
+    pos, neg = set(), set()
+    best = None
+    for m in KEYWORD_RE.finditer(hay):
+        stem = m.group("stem")
+        if stem:
+            pos.add(stem)
+            continue
+        kw = m.group("word")
+        kinds = KEYWORD_KINDS[kw]
+        if "neg" in kinds:
+            neg.add(kw)
+        if "species" in kinds:
+            hit = SPECIES_RANK[kw]
+            if best is None or hit < best:
+                best = hit
+    return KeywordHits(len(pos), len(neg), best[1] if best else None)
+
+def detect_species(title: str, text: str, default: str = "other") -> str:
+    return scan_keywords(f"{title} {text}".lower()).species or default
 
 def detect_country(url: str) -> str:
     try:
@@ -329,234 +1108,1943 @@ def pick_image_from_feed(entry):
 
     return None
 
-def download_image(url: str, referer: str):
-    r = requests.get(url, headers={**UA_HEADERS, "Referer": referer}, timeout=30)
-    r.raise_for_status()
-    return r.content
+# Le immagini vengono scaricate mentre il testo si traduce, validate,
+# ridimensionate se servono e ricordate per url e per hash del contenuto:
+# una foto già pubblicata si rimanda con il file_id di Telegram, senza upload.
+PreparedImage = namedtuple("PreparedImage", "url data content_hash file_id")
+
+def image_file_id(url: str) -> str | None:
+    row = db().execute("""
+        SELECT f.file_id FROM images i JOIN image_files f ON f.content_hash = i.content_hash
+        WHERE i.url = ?
+    """, (url,)).fetchone()
+    return row[0] if row else None
+
+def image_known_bad(url: str) -> bool:
+    row = db().execute("SELECT bad_until FROM images WHERE url=?", (url,)).fetchone()
+    return bool(row and row[0] and row[0] > time.time())
+
+def image_mark_bad(url: str) -> None:
+    c = db()
+    c.execute(
+        "INSERT OR REPLACE INTO images VALUES (?, NULL, ?)",
+        (url, int(time.time()) + IMAGE_BAD_TTL_SEC),
+    )
+    c.commit()
+
+def image_remember(img: PreparedImage, file_id: str | None) -> None:
+    if not img.content_hash:
+        return
+    c = db()
+    c.execute("INSERT OR REPLACE INTO images VALUES (?, ?, NULL)", (img.url, img.content_hash))
+    if file_id:
+        c.execute("INSERT OR REPLACE INTO image_files VALUES (?, ?)", (img.content_hash, file_id))
+    c.commit()
+
+def image_file_id_by_hash(content_hash: str) -> str | None:
+    row = db().execute("SELECT file_id FROM image_files WHERE content_hash=?", (content_hash,)).fetchone()
+    return row[0] if row else None
+
+def fit_for_telegram(data: bytes) -> bytes:
+    # senza Pillow si controlla solo il peso
+    try:
+        from PIL import Image
+    except ImportError:
+        if len(data) > TELEGRAM_PHOTO_MAX_BYTES:
+            raise ValueError(f"immagine di {len(data)} byte, Pillow non installato")
+        return data
+
+    try:
+        im = Image.open(BytesIO(data))
+        w, h = im.size
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ValueError(f"immagine non leggibile: {e}") from e
+    if not w or not h or max(w, h) / min(w, h) > 20:
+        raise ValueError(f"proporzioni non accettate da Telegram: {w}x{h}")
+    if len(data) <= TELEGRAM_PHOTO_MAX_BYTES and max(w, h) <= IMAGE_MAX_SIDE:
+        return data
+    im.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE))
+    out = BytesIO()
+    im.convert("RGB").save(out, "JPEG", quality=85, optimize=True)
+    return out.getvalue()
+
+def prepare_image(url: str, referer: str | None) -> PreparedImage:
+    # gira nel pool immagini: solo rete e CPU, niente sqlite
+    with stats.timer("images"):
+        # in streaming: oltre IMAGE_MAX_DOWNLOAD_BYTES non si scarica né si tiene in memoria
+        r = fetch(url, referer=referer, stream=True, track_health=False)
+        try:
+            ctype = r.headers.get("Content-Type", "").split(";")[0].strip().lower()
+            if ctype and not ctype.startswith("image/"):
+                raise ValueError(f"non è un'immagine: {ctype}")
+            length = r.headers.get("Content-Length", "")
+            if length.isdigit() and int(length) > IMAGE_MAX_DOWNLOAD_BYTES:
+                raise ValueError(f"immagine troppo grande: {length} byte")
+            buf = bytearray()
+            for chunk in r.iter_content(64 * 1024):
+                buf += chunk
+                if len(buf) > IMAGE_MAX_DOWNLOAD_BYTES:
+                    raise ValueError(f"immagine troppo grande: oltre {IMAGE_MAX_DOWNLOAD_BYTES} byte")
+        finally:
+            r.close()
+        data = bytes(buf)
+        stats.incr("http_bytes", len(data))
+        digest = hashlib.sha256(data).hexdigest()
+        return PreparedImage(url, fit_for_telegram(data), digest, None)
+
+def start_image(pool: ThreadPoolExecutor, url: str | None, referer: str | None):
+    # PreparedImage subito se l'url è già noto, altrimenti un Future
+    if not url:
+        return None
+    file_id = image_file_id(url)
+    if file_id:
+        return PreparedImage(url, None, None, file_id)
+    if image_known_bad(url):
+        return None
+    return pool.submit(prepare_image, url, referer)
+
+def resolve_image(pending, url: str | None) -> PreparedImage | None:
+    if pending is None or isinstance(pending, PreparedImage):
+        return pending
+    try:
+        img = pending.result()
+    except ValueError as e:
+        # contenuto non valido: l'url non si riprova per IMAGE_BAD_TTL_SEC
+        print(f"[WARN] Immagine scartata: {url} | {e}")
+        image_mark_bad(url)
+        return None
+    except Exception as e:
+        # download fallito: si lascia provare Telegram con l'url
+        print(f"[WARN] Download immagine fallito: {url} | {e}")
+        return PreparedImage(url, None, None, None)
+    file_id = image_file_id_by_hash(img.content_hash)
+    return img._replace(file_id=file_id) if file_id else img
+
+# ======================
+# FETCH (sessioni keep-alive per host)
+# ======================
+_sessions = {}
+_host_slots = {}
+_sessions_lock = threading.Lock()
+
+def url_host(url: str) -> str:
+    return urlparse(url).netloc.lower()
+
+def get_session(host: str):
+    with _sessions_lock:
+        s = _sessions.get(host)
+        if s is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=FETCH_PER_HOST)
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            s.headers.update(UA_HEADERS)
+            _sessions[host] = s
+            # limita le richieste parallele verso lo stesso host
+            _host_slots[host] = threading.BoundedSemaphore(FETCH_PER_HOST)
+        return s, _host_slots[host]
+
+class HostUnavailable(Exception):
+    pass
+
+class HostHealth:
+    # per host: errori consecutivi, circuito aperto fino a, latenza media.
+    # Condiviso dai thread di download, caricato e salvato dall'App
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hosts = {}
+        self.dirty = set()
+        self.retries_left = RETRY_BUDGET_PER_RUN
+
+    def load(self, conn) -> None:
+        with self.lock:
+            self.hosts = {
+                host: {"failures": failures, "open_until": open_until, "latency": latency}
+                for host, failures, open_until, latency in conn.execute("SELECT * FROM host_health")
+            }
+            self.dirty.clear()
+            self.retries_left = RETRY_BUDGET_PER_RUN
+
+    def save(self, conn) -> None:
+        # solo gli host toccati: gli altri possono averli aggiornati altri shard
+        with self.lock:
+            rows = [(host, h["failures"], h["open_until"], h["latency"])
+                    for host, h in self.hosts.items() if host in self.dirty]
+            self.dirty.clear()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO host_health VALUES (?,?,?,?)", rows)
+
+    def _host(self, host: str) -> dict:
+        self.dirty.add(host)
+        return self.hosts.setdefault(host, {"failures": 0, "open_until": 0, "latency": None})
+
+    def is_open(self, host: str, now: float | None = None) -> bool:
+        # scaduto l'intervallo il circuito lascia passare una prova (half-open)
+        h = self.hosts.get(host)
+        return bool(h and h["open_until"] > (now or time.time()))
+
+    def timeout(self, host: str) -> float:
+        h = self.hosts.get(host)
+        if not h or not h["latency"]:
+            return FETCH_TIMEOUT_SEC
+        return max(FETCH_TIMEOUT_MIN_SEC, min(FETCH_TIMEOUT_SEC, h["latency"] * TIMEOUT_LATENCY_FACTOR))
+
+    def success(self, host: str, latency: float) -> None:
+        with self.lock:
+            h = self._host(host)
+            h["failures"], h["open_until"] = 0, 0
+            h["latency"] = latency if h["latency"] is None else 0.3 * latency + 0.7 * h["latency"]
+
+    def timed_out(self, host: str, timeout: float) -> None:
+        # il prossimo tentativo ha il timeout pieno
+        with self.lock:
+            h = self._host(host)
+            h["latency"] = max(h["latency"] or 0, timeout)
+
+    def failure(self, host: str) -> None:
+        with self.lock:
+            h = self._host(host)
+            h["failures"] += 1
+            if h["failures"] < BREAKER_FAILURES:
+                return
+            delay = min(BREAKER_MAX_SEC, BREAKER_BASE_SEC * 2 ** (h["failures"] - BREAKER_FAILURES))
+            delay *= random.uniform(0.8, 1.2)
+            h["open_until"] = int(time.time() + delay)
+        stats.incr("breaker_opened")
+        print(f"[WARN] {host}: {h['failures']} errori di fila, sospeso per {delay / 60:.0f} min")
+
+    def take_retry(self) -> bool:
+        with self.lock:
+            if self.retries_left <= 0:
+                return False
+            self.retries_left -= 1
+            return True
+
+health = HostHealth()
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+def retry_wait(attempt: int, r=None) -> float:
+    # Retry-After se il server lo indica, altrimenti esponenziale con jitter
+    after = r.headers.get("Retry-After") if r is not None else None
+    if after and after.isdigit():
+        return min(RETRY_MAX_WAIT_SEC, int(after))
+    return min(RETRY_MAX_WAIT_SEC, RETRY_BASE_SEC * 2 ** attempt * random.uniform(0.5, 1.5))
+
+def fetch(url: str, referer: str | None = None, headers: dict | None = None,
+          stream: bool = False, track_health: bool = True) -> requests.Response:
+    # con stream=True ritorna dopo gli header: il corpo lo legge chi lo consuma.
+    # Errori di rete, timeout e 5xx/429 si riprovano finché c'è budget; 401/403
+    # e gli errori finali contano per il circuit breaker dell'host.
+    # track_health=False (immagini): niente circuit breaker, retry né timeout
+    # adattivo, così un hotlink bloccato non sospende le pagine dello stesso host
+    import requests
+
+    host = url_host(url)
+    if track_health and health.is_open(host):
+        stats.incr("breaker_skips")
+        raise HostUnavailable(f"host sospeso dal circuit breaker: {host}")
+    s, slot = get_session(host)
+    retries = FETCH_MAX_RETRIES if track_health else 0
+    for attempt in range(retries + 1):
+        timeout = health.timeout(host) if track_health else FETCH_TIMEOUT_SEC
+        try:
+            with stats.timer("fetch"), slot:
+                r = s.get(url, headers={"Referer": referer or url, **(headers or {})},
+                          timeout=timeout, stream=stream)
+        except requests.RequestException as e:
+            if not track_health:
+                raise
+            if isinstance(e, requests.Timeout):
+                health.timed_out(host, timeout)
+            if not isinstance(e, (requests.ConnectionError, requests.Timeout)):
+                raise
+            if attempt < retries and health.take_retry():
+                stats.incr("http_retries")
+                time.sleep(retry_wait(attempt))
+                continue
+            health.failure(host)
+            raise
+        stats.incr("http_requests")
+        stats.latency("http", r.elapsed.total_seconds())
+        if r.status_code in RETRY_STATUSES and attempt < retries and health.take_retry():
+            stats.incr("http_retries")
+            r.close()
+            time.sleep(retry_wait(attempt, r))
+            continue
+        if track_health:
+            if r.status_code in RETRY_STATUSES or r.status_code in (401, 403):
+                health.failure(host)
+            else:
+                health.success(host, r.elapsed.total_seconds())
+        if not stream:
+            stats.incr("http_bytes", len(r.content))
+        r.raise_for_status()
+        return r
+
+def streamed(src) -> bool:
+    return src.kind == "feed" and FEED_STREAMING
+
+def start_fetches(executor: ThreadPoolExecutor, sources, futures: dict) -> None:
+    # avvia i download della finestra; quelli già in corso non si ripetono
+    for src in sources:
+        if src.url not in futures:
+            futures[src.url] = executor.submit(
+                fetch, src.url, headers=conditional_headers(src.url), stream=streamed(src)
+            )
+
+def close_fetched(future) -> None:
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+def drop_fetches(futures: dict) -> None:
+    # sorgenti mai raggiunte: download annullato se non è partito, altrimenti
+    # la risposta si chiude appena arriva
+    for future in futures.values():
+        if not future.cancel():
+            future.add_done_callback(close_fetched)
+    futures.clear()
+
+def close_sessions() -> None:
+    with _sessions_lock:
+        for s in _sessions.values():
+            s.close()
+        _sessions.clear()
+        _host_slots.clear()
+
+def parse_feed(r: requests.Response, data: bytes | None = None):
+    # feedparser vuole le chiavi in minuscolo
+    import feedparser
+
+    headers = {k.lower(): v for k, v in r.headers.items()}
+    headers.setdefault("content-location", r.url)
+    return feedparser.parse(r.content if data is None else data, response_headers=headers)
+
+def feed_entries(r: requests.Response, data: bytes | None = None) -> list:
+    feed = parse_feed(r, data)
+    if getattr(feed, "bozo", 0):
+        raise ValueError(f"feed problematico: {getattr(feed, 'bozo_exception', '')}")
+    return feed.entries
+
+# ======================
+# FEED IN STREAMING
+# ======================
+# RSS 2.0 / RSS 1.0 / Atom letti a pezzi: ogni voce viene tolta dall'albero
+# appena letta, la memoria non cresce con la lunghezza del feed. Stessi
+# attributi delle voci di feedparser usati da feed_candidate e pick_image_from_feed
+FeedEntry = namedtuple("FeedEntry", "link title summary published media_content media_thumbnail links")
+
+ATOM_NS = "{http://www.w3.org/2005/Atom}"
+MEDIA_NS = "{http://search.yahoo.com/mrss/}"
+CONTENT_NS = "{http://purl.org/rss/1.0/modules/content/}"
+DC_NS = "{http://purl.org/dc/elements/1.1/}"
+FEED_ITEM_TAGS = {"item", "{http://purl.org/rss/1.0/}item", ATOM_NS + "entry"}
+
+def feed_date(text: str | None) -> float | None:
+    from datetime import datetime, timezone
+    from email.utils import parsedate_to_datetime
+
+    if not text:
+        return None
+    text = text.strip()
+    for parse in (parsedate_to_datetime, lambda t: datetime.fromisoformat(t.replace("Z", "+00:00"))):
+        try:
+            d = parse(text)
+        except (TypeError, ValueError, IndexError):
+            continue
+        return (d if d.tzinfo else d.replace(tzinfo=timezone.utc)).timestamp()
+    return None
+
+def feed_entry(item) -> FeedEntry:
+    def text(*tags):
+        for t in tags:
+            el = item.find(t)
+            if el is not None and (el.text or "").strip():
+                return el.text.strip()
+        return ""
+
+    link = text("link", "{http://purl.org/rss/1.0/}link")
+    links = []
+    for el in item.iter(ATOM_NS + "link"):
+        rel = el.get("rel", "alternate")
+        links.append({"rel": rel, "href": el.get("href")})
+        if rel == "alternate" and not link:
+            link = el.get("href") or ""
+    for el in item.iter("enclosure"):
+        links.append({"rel": "enclosure", "href": el.get("url"), "type": el.get("type")})
+
+    return FeedEntry(
+        link=link or text("guid"),
+        title=text("title", "{http://purl.org/rss/1.0/}title", ATOM_NS + "title"),
+        summary=text("description", "{http://purl.org/rss/1.0/}description", ATOM_NS + "summary",
+                     CONTENT_NS + "encoded", ATOM_NS + "content"),
+        published=feed_date(text("pubDate", ATOM_NS + "published", ATOM_NS + "updated", DC_NS + "date")),
+        media_content=[{"url": el.get("url")} for el in item.iter(MEDIA_NS + "content") if el.get("url")],
+        media_thumbnail=[{"url": el.get("url")} for el in item.iter(MEDIA_NS + "thumbnail") if el.get("url")],
+        links=links,
+    )
+
+def entry_timestamp(e) -> float | None:
+    # FeedEntry ha già il timestamp, le voci di feedparser una struct_time
+    ts = getattr(e, "published", None)
+    if isinstance(ts, (int, float)):
+        return ts
+    parsed = getattr(e, "published_parsed", None) or getattr(e, "updated_parsed", None)
+    if not parsed:
+        return None
+    import calendar
+    return calendar.timegm(parsed)
+
+def feed_chunks(r: requests.Response):
+    # rete che cade a metà corpo (timeout di lettura, chunked rotto) come un
+    # feed troncato: si salta la sorgente, non il run
+    import requests
+
+    try:
+        yield from r.iter_content(FEED_CHUNK_BYTES)
+    except requests.RequestException as e:
+        raise ValueError(f"feed interrotto: {e}") from e
+
+def stream_feed(r: requests.Response, url: str):
+    # voci una alla volta mentre il corpo arriva; chiudere il generatore chiude
+    # la connessione e il resto del feed non viene scaricato
+    from xml.etree.ElementTree import ParseError, XMLPullParser
+
+    parser = XMLPullParser(events=("start", "end"))
+    chunks = feed_chunks(r)
+    head = []  # byte letti prima della prima voce, per ripiegare su feedparser
+    stack = []
+    try:
+        for chunk in chunks:
+            stats.incr("http_bytes", len(chunk))
+            stats.source(url, "bytes", len(chunk))
+            if head is not None:
+                head.append(chunk)
+            try:
+                parser.feed(chunk)
+                events = list(parser.read_events())
+            except ParseError as e:
+                if head is None:
+                    raise ValueError(f"feed interrotto: {e}") from e
+                # codifica non supportata da expat o XML sporco: feedparser
+                # tollera entrambi, ma vuole tutto il documento
+                rest = b"".join(chunks)
+                stats.incr("http_bytes", len(rest))
+                stats.source(url, "bytes", len(rest))
+                print(f"[WARN] Streaming non riuscito, uso feedparser: {url} | {e}")
+                yield from feed_entries(r, b"".join(head) + rest)
+                return
+            for event, el in events:
+                if event == "start":
+                    stack.append(el)
+                    continue
+                stack.pop()
+                if el.tag in FEED_ITEM_TAGS:
+                    entry = feed_entry(el)
+                    if stack:
+                        stack[-1].remove(el)
+                    head = None
+                    yield entry
+    finally:
+        r.close()
 
 # ======================
 # SCRAPING APA CHIOGGIA
 # ======================
+@dataclass(slots=True)
+class Animal:
+    # un annuncio letto da una pagina (walker o estrattore per sito)
+    name: str
+    desc: str
+    images: list
+    species: str | None
+    page: str
+    link: str | None = None
+
 def fetch_html(url: str) -> str:
-    r = requests.get(url, headers={**UA_HEADERS, "Referer": url}, timeout=30)
-    r.raise_for_status()
-    return r.text
+    return fetch(url).text
 
 def scrape_rifugio_page(url: str, default_species: str):
-    html = fetch_html(url)
-    soup = BeautifulSoup(html, "html.parser")
-
-    article = soup.find("article") or soup
-    animals = []
-    current = None
-
-    for el in article.find_all(["h2", "h3", "h4", "p", "img"], recursive=True):
-        if el.name in ["h2", "h3", "h4"]:
-            title = el.get_text(" ", strip=True)
-            title = re.sub(r"\s+", " ", title).strip()
-            if not title:
-                continue
-            if title.lower() in {"centro adozioni", "adotta un micio", "cani cercafamiglia"}:
+    return iter_rifugio_animals(fetch_html(url), url, default_species)
+
+WALK_TAGS = ("h2", "h3", "h4", "p", "img")
+
+def iter_page_elements(html: str):
+    # (tag, testo, src) di h2/h3/h4/p/img dentro il primo <article> (o
+    # nella pagina intera), in ordine di documento
+    backend = page_backend()
+    if backend == "selectolax":
+        from selectolax.lexbor import LexborHTMLParser
+
+        tree = LexborHTMLParser(html)
+        root = tree.css_first("article") or tree.root
+        if root is None:
+            return
+        # traverse() crea i nodi uno alla volta, css() li creerebbe tutti subito
+        for node in root.traverse():
+            if node.tag not in WALK_TAGS:
                 continue
-
-            if current and current["name"] and (current["desc"] or current["images"]):
-                animals.append(current)
-
-            current = {"name": title, "desc": "", "images": [], "species": default_species, "page": url}
+            if node.tag == "img":
+                yield "img", "", node.attributes.get("src") or ""
+            else:
+                yield node.tag, node.text(separator=" ", strip=True), ""
+        return
+
+    from bs4 import BeautifulSoup, SoupStrainer
+
+    # si costruisce solo l'albero di <article> e dei tag che servono
+    soup = BeautifulSoup(html, backend, parse_only=SoupStrainer(["article", *WALK_TAGS]))
+    root = soup.find("article") or soup
+    for el in root.descendants:
+        if el.name not in WALK_TAGS:
             continue
-
-        if not current:
+        if el.name == "img":
+            yield "img", "", el.get("src") or ""
+        else:
+            yield el.name, el.get_text(" ", strip=True), ""
+
+RIFUGIO_SKIP_TITLES = {"centro adozioni", "adotta un micio", "cani cercafamiglia"}
+
+def _rifugio_animal(name: str | None, paragraphs: list, images: list, url: str,
+                    default_species: str) -> Animal | None:
+    if not name or not (paragraphs or images):
+        return None
+    # immagini senza doppioni, al massimo 6
+    return Animal(name, "\n".join(paragraphs), list(dict.fromkeys(images))[:6], default_species, url)
+
+def iter_rifugio_animals(html: str, url: str, default_species: str):
+    # ogni animale esce appena inizia il titolo successivo: chi legge può
+    # fermarsi senza costruire il resto della pagina
+    name, paragraphs, images = None, [], []
+
+    for tag, text, src in iter_page_elements(html):
+        if tag in ("h2", "h3", "h4"):
+            title = WS_RE.sub(" ", text).strip()
+            if not title or title.lower() in RIFUGIO_SKIP_TITLES:
+                continue
+            animal = _rifugio_animal(name, paragraphs, images, url, default_species)
+            if animal:
+                yield animal
+            name, paragraphs, images = title, [], []
+        elif name is None:
             continue
+        elif tag == "p":
+            txt = WS_RE.sub(" ", text).strip()
+            if txt:
+                paragraphs.append(txt)
+        elif src.startswith("http"):
+            images.append(src)
 
-        if el.name == "p":
-            txt = el.get_text(" ", strip=True)
-            txt = re.sub(r"\s+", " ", txt).strip()
-            if not txt:
-                continue
-            current["desc"] = (current["desc"] + "\n" + txt).strip()
+    animal = _rifugio_animal(name, paragraphs, images, url, default_species)
+    if animal:
+        yield animal
 
-        if el.name == "img":
-            src = el.get("src") or ""
-            if src.startswith("http"):
-                current["images"].append(src)
+def parse_rifugio_page(html: str, url: str, default_species: str) -> list:
+    return list(iter_rifugio_animals(html, url, default_species))
 
-    if current and current["name"] and (current["desc"] or current["images"]):
-        animals.append(current)
+# ======================
+# ESTRATTORI PER SITO
+# ======================
+# Regole dichiarative per host (senza "www."), provate prima del walker
+# generico; se non trovano nessun animale si torna al walker.
+#   json_ld      True: annunci dagli <script type="application/ld+json">
+#   next_data    percorso della lista annunci dentro __NEXT_DATA__;
+#                () = prima lista di oggetti con un nome
+#   cards        selettore CSS della scheda di un animale, con dentro
+#                name/desc/image/link ("sel@attr", più attributi con "|")
+#   max_pages    pagine da leggere, con page_param come parametro di query
+SITE_EXTRACTORS = {
+    "petfinder.com": {"json_ld": True, "next_data": ()},
+    "adoptapet.com": {
+        "json_ld": True,
+        "next_data": (),
+        "cards": "[data-testid='pet-card'], .pet-card",
+        "name": "[data-testid='pet-card-name'], .pet-card__name, h3",
+        "desc": "[data-testid='pet-card-details'], .pet-card__details, p",
+        "image": "img@data-src|src",
+        "link": "a@href",
+    },
+    "petrescue.com.au": {
+        "json_ld": True,
+        "next_data": (),
+        "cards": "article.cards-listings-preview",
+        "name": "h3, .cards-listings-preview__content__name",
+        "desc": ".cards-listings-preview__content__section, p",
+        "image": "img@data-src|src",
+        "link": "a@href",
+    },
+    "empethy.it": {
+        "json_ld": True,
+        "cards": ".card-animale, .animal-card",
+        "name": ".card-title, h3, h5",
+        "desc": ".card-text, p",
+        "image": "img@data-src|src",
+        "link": "a@href",
+        "max_pages": 2,
+        "page_param": "page",
+    },
+    "secondechance.org": {
+        "cards": ".animal-card, .card-animal",
+        "name": ".animal-card__name, .card-title, h3",
+        "desc": ".animal-card__infos, .card-text, p",
+        "image": "img@data-src|src",
+        "link": "a@href",
+    },
+    "adotta.me": {
+        "json_ld": True,
+        "cards": ".annuncio, .card-annuncio",
+        "name": ".titolo, h3, h2",
+        "desc": ".descrizione, p",
+        "image": "img@data-src|src",
+        "link": "a@href",
+    },
+    "dogstrust.org.uk": {
+        "next_data": (),
+        "cards": "a[href*='/rehoming/dogs/']",
+        "name": "h3, h2",
+        "desc": "p",
+        "image": "img@src",
+        "link": "@href",
+    },
+}
 
-    # dedup immagini
-    for a in animals:
-        seen = set()
-        uniq = []
-        for im in a["images"]:
-            if im not in seen:
-                seen.add(im)
-                uniq.append(im)
-        a["images"] = uniq[:6]
+LD_JSON_RE = re.compile(r'<script[^>]+type=["\']application/ld\+json["\'][^>]*>(.*?)</script>', re.S | re.I)
+NEXT_DATA_RE = re.compile(r'<script[^>]+id=["\']__NEXT_DATA__["\'][^>]*>(.*?)</script>', re.S | re.I)
+LD_ANIMAL_TYPES = {"pet", "animal", "dog", "cat", "product", "individualproduct", "thing"}
+
+# campi cercati negli oggetti JSON (percorsi puntati, il primo che c'è vince)
+JSON_NAME_KEYS = ("name", "petName", "title")
+JSON_DESC_KEYS = ("description", "summary", "story", "breed.primary", "breeds.primary", "breed")
+JSON_IMAGE_KEYS = ("image", "image.url", "photo", "photos.0.url", "photos.0.medium", "photos.0", "primaryPhotoUrl", "media.0.url")
+JSON_LINK_KEYS = ("url", "link", "href", "permalink")
+JSON_SPECIES_KEYS = ("species", "type", "animalType")
+
+def site_extractor(url: str) -> dict | None:
+    host = url_host(url)
+    return SITE_EXTRACTORS.get(host[4:] if host.startswith("www.") else host)
+
+def _json_get(obj, path: str):
+    for key in path.split("."):
+        if isinstance(obj, list):
+            obj = obj[int(key)] if key.isdigit() and len(obj) > int(key) else None
+        elif isinstance(obj, dict):
+            obj = obj.get(key)
+        else:
+            return None
+        if obj is None:
+            return None
+    return obj
+
+def _json_first(obj: dict, keys) -> str:
+    for k in keys:
+        v = _json_get(obj, k)
+        if isinstance(v, list):
+            v = v[0] if v else None
+        if isinstance(v, dict):
+            v = v.get("url") or v.get("name")
+        if isinstance(v, (str, int, float)) and str(v).strip():
+            return str(v).strip()
+    return ""
+
+def _json_animal(obj: dict, url: str, default_species: str | None) -> Animal | None:
+    name = _json_first(obj, JSON_NAME_KEYS)
+    if not name:
+        return None
+    desc = _json_first(obj, JSON_DESC_KEYS)
+    image = _json_first(obj, JSON_IMAGE_KEYS)
+    link = _json_first(obj, JSON_LINK_KEYS)
+    species = _json_first(obj, JSON_SPECIES_KEYS)
+    if not desc and not image:
+        return None
+    return Animal(
+        WS_RE.sub(" ", name),
+        desc,
+        [urljoin(url, image)] if image else [],
+        detect_species(species, "", default=default_species) if species else default_species,
+        url,
+        urljoin(url, link) if link else None,
+    )
+
+def _ld_objects(node):
+    # appiattisce @graph / ItemList / ListItem
+    if isinstance(node, list):
+        for n in node:
+            yield from _ld_objects(n)
+    elif isinstance(node, dict):
+        if "@graph" in node:
+            yield from _ld_objects(node["@graph"])
+        elif "itemListElement" in node:
+            yield from _ld_objects(node["itemListElement"])
+        elif "item" in node and isinstance(node["item"], dict):
+            yield from _ld_objects(node["item"])
+        else:
+            yield node
+
+def extract_json_ld(html: str, url: str, default_species: str | None):
+    for m in LD_JSON_RE.finditer(html):
+        try:
+            data = json.loads(m.group(1))
+        except ValueError:
+            continue
+        for obj in _ld_objects(data):
+            types_ = obj.get("@type") or ()
+            types_ = {t.lower() for t in ([types_] if isinstance(types_, str) else types_) if isinstance(t, str)}
+            if not types_ & LD_ANIMAL_TYPES:
+                continue
+            a = _json_animal(obj, url, default_species)
+            if a:
+                yield a
+
+def _find_named_list(node, depth: int = 0):
+    # prima lista (in profondità) di almeno 2 oggetti che hanno un nome
+    if depth > 12:
+        return None
+    if isinstance(node, list):
+        dicts = [n for n in node if isinstance(n, dict)]
+        if len(dicts) >= 2 and all(_json_first(d, JSON_NAME_KEYS) for d in dicts):
+            return dicts
+        children = node
+    elif isinstance(node, dict):
+        children = node.values()
+    else:
+        return None
+    for child in children:
+        found = _find_named_list(child, depth + 1)
+        if found:
+            return found
+    return None
 
-    return animals
+def extract_next_data(html: str, url: str, default_species: str | None, path):
+    m = NEXT_DATA_RE.search(html)
+    if not m:
+        return
+    try:
+        data = json.loads(m.group(1))
+    except ValueError:
+        return
+    items = _json_get(data, ".".join(path)) if path else _find_named_list(data)
+    if not isinstance(items, list):
+        return
+    for o in items:
+        a = _json_animal(o, url, default_species) if isinstance(o, dict) else None
+        if a:
+            yield a
+
+def _is_lexbor(node) -> bool:
+    return type(node).__module__.startswith("selectolax")
+
+def _css_select(node, selector: str):
+    return node.css(selector) if _is_lexbor(node) else node.select(selector)
+
+def _css_value(node, rule: str) -> str:
+    # "sel" -> testo, "sel@a|b" -> primo attributo presente, "@a" -> sulla scheda
+    sel, _, attrs = rule.partition("@")
+    target = node
+    if sel:
+        found = _css_select(node, sel)
+        if not found:
+            return ""
+        target = found[0]
+    if not attrs:
+        if _is_lexbor(target):
+            return target.text(separator=" ", strip=True)
+        return target.get_text(" ", strip=True)
+    get = target.attributes.get if _is_lexbor(target) else target.get
+    for a in attrs.split("|"):
+        v = get(a)
+        if v:
+            return v
+    return ""
+
+def extract_cards(html: str, url: str, default_species: str | None, spec: dict):
+    if page_backend() == "selectolax":
+        from selectolax.lexbor import LexborHTMLParser
+        root = LexborHTMLParser(html).root
+    else:
+        from bs4 import BeautifulSoup
+        root = BeautifulSoup(html, bs4_parser())
+    if root is None:
+        return
+    for card in _css_select(root, spec["cards"]):
+        name = WS_RE.sub(" ", _css_value(card, spec.get("name", "h3"))).strip()
+        if not name:
+            continue
+        desc = WS_RE.sub(" ", _css_value(card, spec.get("desc", "p"))).strip()
+        image = _css_value(card, spec.get("image", "img@src"))
+        link = _css_value(card, spec.get("link", "a@href"))
+        if not desc and not image:
+            continue
+        yield Animal(
+            name,
+            desc,
+            [urljoin(url, image)] if image else [],
+            default_species,
+            url,
+            urljoin(url, link) if link else None,
+        )
+
+def extract_site(html: str, url: str, default_species: str | None, spec: dict):
+    # prima strategia che trova qualcosa; le altre non vengono nemmeno provate
+    strategies = []
+    if spec.get("json_ld"):
+        strategies.append(lambda: extract_json_ld(html, url, default_species))
+    if "next_data" in spec:
+        strategies.append(lambda: extract_next_data(html, url, default_species, spec["next_data"]))
+    if spec.get("cards"):
+        strategies.append(lambda: extract_cards(html, url, default_species, spec))
+    # stesso animale da più schede: un solo annuncio
+    seen = set()
+    for strategy in strategies:
+        for a in strategy():
+            key = a.link or a.name
+            if key not in seen:
+                seen.add(key)
+                yield a
+        if seen:
+            return
+
+def page_urls(url: str, spec: dict | None) -> list:
+    # pagine successive alla prima secondo page_param/max_pages
+    if not spec or spec.get("max_pages", 1) <= 1 or not spec.get("page_param"):
+        return []
+    parts = urlparse(url)
+    query = dict(parse_qsl(parts.query, keep_blank_values=True))
+    first = int(query.get(spec["page_param"], 1) or 1)
+    out = []
+    for n in range(first + 1, first + spec["max_pages"]):
+        query[spec["page_param"]] = str(n)
+        out.append(parts._replace(query=urlencode(query)).geturl())
+    return out
+
+def iter_page(html: str, url: str, default_species: str | None):
+    spec = site_extractor(url)
+    if spec:
+        found = False
+        for a in extract_site(html, url, default_species, spec):
+            found = True
+            yield a
+        if found:
+            return
+    yield from iter_rifugio_animals(html, url, default_species)
+
+def parse_page(html: str, url: str, default_species: str | None) -> list:
+    return list(iter_page(html, url, default_species))
+
+def scrape_entries(src, r):
+    # le pagine successive si scaricano solo se chi legge arriva in fondo alla
+    # precedente (di solito il run si ferma prima, a MAX_POSTS_PER_RUN)
+    yield from iter_page(r.text, src.url, src.default_species)
+    spec = site_extractor(src.url)
+    for url in page_urls(src.url, spec):
+        try:
+            html = fetch(url, referer=src.url).text
+        except Exception as e:
+            # come un feed troncato: la sorgente va riletta al prossimo run
+            raise ValueError(f"pagina {url}: {e}") from e
+        found = False
+        for a in extract_site(html, url, src.default_species, spec):
+            found = True
+            yield a
+        if not found:
+            return
 
 # ======================
 # POSTING
 # ======================
+LANG_FLAGS = {"en": "🇬🇧", "it": "🇮🇹", "es": "🇪🇸", "fr": "🇫🇷", "de": "🇩🇪", "pt": "🇵🇹"}
+
+def tg_len(text: str) -> int:
+    # Telegram conta le unità UTF-16: le bandiere valgono 4, non 2
+    return len(text.encode("utf-16-le")) // 2
+
+def shorten(text: str, limit: int) -> str:
+    if tg_len(text) <= limit:
+        return text
+    if limit <= 1:
+        return ""
+    cut = text.encode("utf-16-le")[:(limit - 1) * 2].decode("utf-16-le", errors="ignore")
+    return cut.rstrip() + "…"
+
 def build_message(
     title: str,
     species: str,
     country: str,
-    en: str,
-    it: str,
-    es: str,
-    fr: str,
-    de: str,
+    texts: dict,
+    languages,
     url: str,
-    hashtags: str
+    hashtags: str,
+    limit: int = TELEGRAM_TEXT_MAX,
 ) -> str:
-    return f"""🐾 {title}
-🏷 {species.upper()} • 🌍 {country}
-
-🇬🇧
-{en}
-
-🇮🇹
-{it}
-
-🇪🇸
-{es}
+    # un blocco per lingua del canale; se non ci sta, si accorciano le
+    # traduzioni (le più lunghe per prime) e restano titolo, link e hashtag
+    head = f"🐾 {title}\n🏷 {species.upper()} • 🌍 {country}\n"
+    tail = f"\n🔗 {url}\n\n{hashtags}\n"
+    blocks = [(LANG_FLAGS.get(l, l.upper()), texts.get(l) or "") for l in languages]
+
+    def render(bodies):
+        return head + "".join(f"\n{flag}\n{body}\n" for (flag, _), body in zip(blocks, bodies)) + tail
+
+    message = render([t for _, t in blocks])
+    if tg_len(message) <= limit:
+        return message
+
+    room = limit - tg_len(render([""] * len(blocks)))
+    budgets = {}
+    left = len(blocks)
+    for k in sorted(range(len(blocks)), key=lambda k: tg_len(blocks[k][1])):
+        budgets[k] = min(tg_len(blocks[k][1]), max(0, room) // left)
+        room -= budgets[k]
+        left -= 1
+    return shorten(render([shorten(t, budgets[k]) for k, (_, t) in enumerate(blocks)]), limit)
+
+def telegram_call(method, build=None, **kwargs):
+    from telegram.error import RetryAfter
+
+    # rispetta il retry_after dei 429 invece di dormire alla cieca.
+    # build(): argomenti da ricreare a ogni tentativo (un BytesIO già letto
+    # al primo invio ripartirebbe vuoto)
+    for attempt in range(TELEGRAM_MAX_RETRIES + 1):
+        t0 = time.perf_counter()
+        try:
+            return method(**kwargs, **(build() if build else {}))
+        except RetryAfter as e:
+            if attempt == TELEGRAM_MAX_RETRIES:
+                raise
+            stats.incr("telegram_retries")
+            print(f"[WARN] Telegram 429, attendo {e.retry_after}s")
+            time.sleep(e.retry_after + 0.5)
+        except Exception:
+            stats.incr("telegram_errors")
+            raise
+        finally:
+            stats.latency("telegram", time.perf_counter() - t0)
+
+def input_photo(image: PreparedImage):
+    # file_id già noto, bytes già scaricati o, in mancanza, l'url per Telegram
+    return image.file_id or (BytesIO(image.data) if image.data else image.url)
+
+def send_album(bot, chat: str, caption: str, images: list) -> list:
+    from telegram import InputMediaPhoto
+
+    def build():
+        return {"media": [
+            InputMediaPhoto(input_photo(im), caption=caption if i == 0 else None)
+            for i, im in enumerate(images)
+        ]}
+
+    msgs = telegram_call(bot.send_media_group, build, chat_id=chat)
+    return [(im, m.photo[-1].file_id if m and m.photo else None) for im, m in zip(images, msgs or [])]
+
+def send_post(bot, chat: str, title: str, caption: str, text: str, images: list) -> list | None:
+    # album se ci sono almeno due foto, poi una foto sola, poi solo testo
+    # (caption e text già nei limiti di Telegram). Ritorna le coppie
+    # (PreparedImage, file_id) effettivamente pubblicate, None se non è
+    # partito niente.
+    from telegram.error import RetryAfter
 
-🇫🇷
-{fr}
+    try:
+        if POST_ALBUMS and len(images) >= 2:
+            # un url che Telegram non riesce a scaricare fa fallire tutto
+            # l'album: si riprova con le sole foto già in mano
+            uploadable = [im for im in images if im.file_id or im.data]
+            attempts = [images] if len(uploadable) == len(images) else [images, uploadable]
+            for attempt in attempts:
+                if len(attempt) < 2:
+                    continue
+                try:
+                    sent = send_album(bot, chat, caption, attempt[:ALBUM_MAX_IMAGES])
+                    print(f"[OK] Album ({len(sent)} foto) {chat}: {title}")
+                    return sent
+                except RetryAfter:
+                    raise
+                except Exception as e:
+                    print(f"[WARN] Album fallito: {title} | {e}")
+            images = uploadable or images
+
+        if images:
+            try:
+                msg = telegram_call(
+                    bot.send_photo, lambda: {"photo": input_photo(images[0])}, chat_id=chat, caption=caption
+                )
+                print(f"[OK] Foto {chat}: {title}")
+                return [(images[0], msg.photo[-1].file_id if msg and msg.photo else None)]
+            except RetryAfter:
+                raise
+            except Exception as e:
+                print(f"[WARN] Foto fallita: {title} | {e}")
+
+        telegram_call(bot.send_message, chat_id=chat, text=text)
+        print(f"[OK] Testo {chat}: {title}")
+        return []
+    except Exception as e:
+        print(f"[ERR] Invio fallito {chat}: {title} | {e}")
+    return None
 
-🇩🇪
-{de}
+def channels_for(c: dict) -> list:
+    return [
+        ch for ch in CHANNELS
+        if (not ch.get("species") or c["species"] in ch["species"])
+        and (not ch.get("countries") or c["country"] in ch["countries"])
+    ]
 
-🔗 {url}
+def reuse_uploads(images: list, sent: list) -> list:
+    # foto già caricate: i canali successivi usano il file_id, niente upload
+    file_ids = {im.url: fid for im, fid in sent if fid}
+    return [im._replace(file_id=file_ids[im.url], data=None) if im.url in file_ids else im for im in images]
 
-{hashtags}
-"""
+# ======================
+# ARCHIVIO (annunci pubblicati)
+# ======================
+# Una riga per annuncio con colonne filtrabili (specie, paese, data) e il
+# resto (testo pulito, traduzioni, immagini, file_id) in un JSON compresso.
+# archive_fts indicizza titolo e testi in tutte le lingue.
+def archive_post(c: dict, file_ids: list) -> None:
+    body = {
+        "raw": c["raw"],
+        "texts": c["texts"],
+        "images": c["images"],
+        "file_ids": [f for f in file_ids if f],
+        "hashtags": c["hashtags"],
+    }
+    blob = zlib.compress(json.dumps(body, ensure_ascii=False).encode(), ARCHIVE_ZLIB_LEVEL)
+    conn = archive_db()
+    with conn:
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO archive VALUES (NULL,?,?,?,?,?,?,?,?,?,?)",
+            (c["ad_id"], int(time.time()), c["source"], c["url"], c["title"], c["species"],
+             c["country"], c["lang"], text_hash(c["raw"]), blob),
+        )
+        if cur.rowcount:
+            conn.execute(
+                "INSERT INTO archive_fts(rowid, title, text) VALUES (?,?,?)",
+                (cur.lastrowid, c["title"], archive_fts_text(body)),
+            )
 
-def send_post(title: str, message: str, image_url: str | None, image_referer: str | None):
+def archive_body(blob: bytes) -> dict:
+    return json.loads(zlib.decompress(blob))
+
+def archive_fts_text(body: dict) -> str:
+    return "\n".join([body["raw"], *body["texts"].values()])
+
+def archive_expire(days: int = ARCHIVE_RETENTION_DAYS) -> int:
+    # un indice contentless si cancella ripassando gli stessi valori indicizzati
+    conn = archive_db()
+    rows = conn.execute(
+        "SELECT id, title, body FROM archive WHERE posted < ?", (int(time.time()) - days * 86400,)
+    ).fetchall()
+    with conn:
+        for row_id, title, blob in rows:
+            conn.execute(
+                "INSERT INTO archive_fts(archive_fts, rowid, title, text) VALUES ('delete',?,?,?)",
+                (row_id, title, archive_fts_text(archive_body(blob))),
+            )
+        conn.executemany("DELETE FROM archive WHERE id=?", [(row_id,) for row_id, _, _ in rows])
+    return len(rows)
+
+def archived_texts(raw: str, lang: str) -> dict:
+    # stesso testo già pubblicato: traduzioni pronte anche se la cache è stata potata
+    row = archive_db().execute(
+        "SELECT body FROM archive WHERE raw_hash=? AND lang=? ORDER BY posted DESC LIMIT 1",
+        (text_hash(raw), lang),
+    ).fetchone()
+    return archive_body(row[0])["texts"] if row else {}
+
+def fts_query(text: str) -> str:
+    # ogni parola tra virgolette: niente sintassi FTS5 dall'esterno
+    return " ".join('"' + w.replace('"', '""') + '"' for w in text.split())
+
+def search_archive(query: str | None = None, species: str | None = None, country: str | None = None,
+                   since: float | None = None, limit: int = ARCHIVE_SEARCH_LIMIT) -> list:
+    # gli id crescono con la data di pubblicazione: con una ricerca testuale si
+    # scorre l'indice FTS per rowid decrescente invece di ordinare tutti i match
+    cols = "a.id, a.posted, a.species, a.country, a.lang, a.title, a.url"
+    where, params = [], []
+    if query:
+        sql = f"SELECT {cols} FROM archive_fts f JOIN archive a ON a.id = f.rowid"
+        order = "f.rowid DESC"
+        where.append("archive_fts MATCH ?")
+        params.append(fts_query(query))
+    else:
+        sql = f"SELECT {cols} FROM archive a"
+        order = "a.posted DESC, a.id DESC"
+    if species:
+        where.append("a.species = ?")
+        params.append(species)
+    if country:
+        where.append("a.country = ?")
+        params.append(country.upper())
+    if since:
+        where.append("a.posted >= ?")
+        params.append(int(since))
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {order} LIMIT ?"
+    params.append(limit)
+    return archive_db().execute(sql, params).fetchall()
+
+def parse_since(value: str) -> float:
+    # "7d", "24h", "30m", "2w" oppure una data "2024-05-01"
+    units = {"m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+    if value[:-1].isdigit() and value[-1] in units:
+        return time.time() - int(value[:-1]) * units[value[-1]]
+    from datetime import datetime, timezone
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp()
+
+def archive_cli(args) -> None:
+    # init_db sposta un eventuale archivio rimasto in ads.db
+    init_db()
     try:
-        if image_url:
-            # prova invio diretto url
-            try:
-                bot.send_photo(chat_id=CHANNEL, photo=image_url, caption=message)
-                print(f"[OK] Foto URL: {title}")
+        if args.show:
+            row = archive_db().execute("SELECT * FROM archive WHERE id=?", (args.show,)).fetchone()
+            if not row:
+                print(f"[ERR] Nessun annuncio con id {args.show}")
                 return
-            except Exception as e_url:
-                print(f"[WARN] Foto URL fallita: {title} | {e_url}")
+            keys = ("id", "ad_id", "posted", "source", "url", "title", "species", "country", "lang", "raw_hash")
+            out = {k: v for k, v in zip(keys, row) if k != "ad_id"}
+            out.update(archive_body(row[-1]))
+            print(json.dumps(out, indent=2, ensure_ascii=False))
+            return
+        t0 = time.perf_counter()
+        rows = search_archive(
+            args.search or None, args.species, args.country,
+            parse_since(args.since) if args.since else None, args.limit,
+        )
+        for id_, posted, species, country, lang, title, url in rows:
+            day = time.strftime("%Y-%m-%d", time.localtime(posted))
+            print(f"{id_:>7}  {day}  {species:<7} {country:<3} {lang or '':<2}  {title}  {url}")
+        print(f"[OK] {len(rows)} risultati in {(time.perf_counter() - t0) * 1000:.1f} ms")
+    finally:
+        close_db()
 
-            # fallback: scarica bytes
-            if image_referer:
-                try:
-                    b = download_image(image_url, referer=image_referer)
-                    bot.send_photo(chat_id=CHANNEL, photo=BytesIO(b), caption=message)
-                    print(f"[OK] Foto bytes: {title}")
-                    return
-                except Exception as e_bytes:
-                    print(f"[WARN] Foto bytes fallita: {title} | {e_bytes}")
-
-        bot.send_message(chat_id=CHANNEL, text=message)
-        print(f"[OK] Testo: {title}")
-    except Exception as e:
-        print(f"[ERR] Invio fallito: {title} | {e}")
+# ======================
+# SCHEDULER
+# ======================
+# Ogni run sceglie quali sorgenti scaricare invece di ripartire sempre dalla
+# prima: punteggio = rendimento medio (nuovi annunci per fetch) x tempo
+# dall'ultimo fetch, cioè un round-robin pesato sul rendimento. Le sorgenti
+# che non producono nulla vanno in backoff esponenziale; il cursore permette
+# di riprendere una pagina invariata dal punto in cui il run precedente si è
+# fermato per MAX_POSTS_PER_RUN.
+Source = namedtuple("Source", "url kind default_species country priority")
+
+def all_sources() -> list:
+    out = [Source(u, "scrape", sp, cc, i) for i, (u, sp, cc) in enumerate(SCRAPE_SOURCES)]
+    seen = set()
+    for u in FEEDS:
+        if u not in seen:
+            seen.add(u)
+            out.append(Source(u, "feed", None, None, len(out)))
+    return out
+
+class SourceState:
+    __slots__ = (
+        "url", "last_fetched", "fetches", "yields", "yield_rate",
+        "empty_streak", "backoff_until", "cursor", "cursor_hash", "high_water",
+        "run_yield", "run_error",
+    )
+
+    def __init__(self, url, last_fetched=0, fetches=0, yields=0, yield_rate=1.0,
+                 empty_streak=0, backoff_until=0, cursor=0, cursor_hash=None, high_water=None):
+        self.url = url
+        self.last_fetched = last_fetched
+        self.fetches = fetches
+        self.yields = yields
+        self.yield_rate = yield_rate
+        self.empty_streak = empty_streak
+        self.backoff_until = backoff_until
+        self.cursor = cursor
+        self.cursor_hash = cursor_hash
+        self.high_water = high_water
+        self.run_yield = None
+        self.run_error = False
+
+class Scheduler:
+    def __init__(self, conn):
+        self.conn = conn
+        self.states = {
+            row[0]: SourceState(*row)
+            for row in conn.execute("SELECT * FROM source_state")
+        }
+
+    def state(self, url: str) -> SourceState:
+        st = self.states.get(url)
+        if st is None:
+            st = self.states[url] = SourceState(url)
+        return st
+
+    def plan(self, sources, limit: int = SOURCES_PER_RUN, now: float | None = None) -> list:
+        now = now or time.time()
+        ready = []
+        for src in sources:
+            st = self.state(src.url)
+            if st.backoff_until > now:
+                continue
+            if not st.last_fetched:
+                score = float("inf")  # mai scaricata
+            else:
+                score = (st.yield_rate + SCHEDULER_MIN_RATE) * (now - st.last_fetched)
+            ready.append((-score, src.priority, src))
+        ready.sort(key=lambda x: (x[0], x[1]))
+        return [src for _, _, src in ready[:limit]]
+
+    # --- esito del run, per sorgente
+    def fetched(self, url: str) -> None:
+        st = self.state(url)
+        if st.run_yield is None:
+            st.run_yield = 0
+
+    def failed(self, url: str) -> None:
+        self.fetched(url)
+        self.state(url).run_error = True
+
+    def yielded(self, url: str) -> None:
+        self.fetched(url)
+        self.state(url).run_yield += 1
+
+    def cursor(self, url: str, page_hash: str) -> int:
+        st = self.state(url)
+        # pagina cambiata: si riparte dall'inizio
+        return st.cursor if st.cursor_hash == page_hash else 0
+
+    def set_cursor(self, url: str, cursor: int, page_hash: str | None) -> None:
+        st = self.state(url)
+        st.cursor, st.cursor_hash = cursor, page_hash
+
+    def interrupted(self, url: str) -> bool:
+        return self.state(url).cursor > 0
+
+    def high_water(self, url: str) -> float:
+        return self.state(url).high_water or 0.0
+
+    def set_high_water(self, url: str, ts: float) -> None:
+        st = self.state(url)
+        st.high_water = max(st.high_water or 0.0, ts)
+
+    def save(self, now: float | None = None) -> None:
+        now = int(now or time.time())
+        rows = []
+        for st in self.states.values():
+            # solo le sorgenti di questo run: le altre possono essere di altri shard
+            if st.run_yield is None:
+                continue
+            st.fetches += 1
+            st.yields += st.run_yield
+            st.last_fetched = now
+            st.yield_rate = SCHEDULER_EWMA_ALPHA * st.run_yield + (1 - SCHEDULER_EWMA_ALPHA) * st.yield_rate
+            if st.run_yield and not st.run_error:
+                st.empty_streak = 0
+                st.backoff_until = 0
+            else:
+                st.empty_streak += 1
+                delay = min(SCHEDULER_BACKOFF_MAX_SEC, SCHEDULER_BACKOFF_BASE_SEC * 2 ** (st.empty_streak - 1))
+                # le prime fetch a vuoto sono normali: backoff dalla terza
+                st.backoff_until = now + delay if st.empty_streak >= 3 else 0
+            st.run_yield, st.run_error = None, False
+            rows.append((
+                st.url, st.last_fetched, st.fetches, st.yields, st.yield_rate,
+                st.empty_streak, st.backoff_until, st.cursor, st.cursor_hash, st.high_water,
+            ))
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO source_state VALUES (?,?,?,?,?,?,?,?,?,?)", rows)
 
 # ======================
-def main():
-    posted = 0
-    
-    # --- 1) Scraping pagine APA Chioggia
-    for page_url, default_species, fixed_country in SCRAPE_SOURCES:
-        if posted >= MAX_POSTS_PER_RUN:
-            break
+# PIPELINE
+# ======================
+# fetch (thread pool) -> parse/filtro/dedup (thread principale)
+#   -> traduzione (thread) -> invio Telegram (thread), collegati da code limitate
+PIPELINE_QUEUE_SIZE = 2
+_DONE = object()
+
+def hand_off(q: queue.Queue, item, consumer: threading.Thread) -> bool:
+    # put che non resta appeso se la fase successiva è morta con la coda piena
+    while True:
         try:
-            items = scrape_rifugio_page(page_url, default_species=default_species)
+            q.put(item, timeout=1)
+            return True
+        except queue.Full:
+            if not consumer.is_alive():
+                return False
+
+def scrape_candidate(src: Source, item: Animal, is_new) -> dict | None:
+    # gli estrattori per sito danno il link alla scheda: id stabile come per i feed
+    link = item.link
+    ad_id = make_ad_id(link) if link else make_ad_id(item.page, item.name)
+    if not is_new(ad_id):
+        return None
+    # prima degli estrattori l'id era sempre pagina+nome: gli annunci già
+    # pubblicati così non vanno ripubblicati (il controllo li tiene anche vivi
+    # in seen_ads)
+    if link and not is_new(make_ad_id(item.page, item.name)):
+        return None
+    raw = clean_html(item.desc or item.name)
+    raw = remove_wp_footer(raw)
+    # filtro adozioni
+    if not looks_like_adoption(item.name, raw):
+        return None
+    species = item.species or "other"
+    country = src.country or "UNK"
+    if ALLOWED_SPECIES and species not in ALLOWED_SPECIES:
+        return None
+    if ALLOWED_COUNTRIES and country not in ALLOWED_COUNTRIES:
+        return None
+    return {
+        "source": src.url,
+        "ad_id": ad_id,
+        "save_url": link or item.page + "#" + item.name,
+        "title": item.name,
+        "raw": raw,
+        "species": species,
+        "country": country,
+        "lang_hint": language_hint(link or item.page, src.country),
+        "url": link or item.page,
+        "images": item.images,
+        "referer": item.page,
+    }
+
+def feed_candidate(src: Source, e, is_new) -> dict | None:
+    link = getattr(e, "link", None)
+    title = getattr(e, "title", None)
+    if not link or not title:
+        return None
+    ad_id = make_ad_id(link)
+    if not is_new(ad_id):
+        return None
+    raw_html = getattr(e, "summary", "") or getattr(e, "description", "") or title
+    raw = clean_html(raw_html)
+    raw = remove_wp_footer(raw)
+    # filtro adozioni
+    if not looks_like_adoption(title, raw):
+        return None
+    species = detect_species(title, raw, default="other")
+    country = detect_country(link)
+    image = pick_image_from_feed(e)
+    if ALLOWED_SPECIES and species not in ALLOWED_SPECIES:
+        return None
+    if ALLOWED_COUNTRIES and country not in ALLOWED_COUNTRIES:
+        return None
+    return {
+        "source": src.url,
+        "ad_id": ad_id,
+        "save_url": link,
+        "title": title.strip(),
+        "raw": raw,
+        "species": species,
+        "country": country,
+        "lang_hint": language_hint(link, country),
+        "url": link,
+        "images": [image] if image else [],
+        "referer": link,
+    }
+
+def source_entries(src: Source, r):
+    # generatore per le pagine e per i feed in streaming, lista per feedparser
+    if src.kind == "scrape":
+        return scrape_entries(src, r)
+    if streamed(src):
+        return stream_feed(r, src.url)
+    return feed_entries(r)
+
+class FeedCutoff:
+    # i feed vanno dal più recente al più vecchio: dopo FEED_STALE_STREAK voci
+    # di fila più vecchie dell'high-water mark (o già viste, per le voci senza
+    # data) il resto è già noto. Le voci già viste non contano se il run
+    # precedente si è fermato a metà feed: dopo ci sono voci mai lette
+    def __init__(self, high_water: float, count_seen: bool):
+        self.high_water = high_water
+        self.count_seen = count_seen
+        self.newest = 0.0
+        self.streak = 0
+
+    def stop(self, entry, seen) -> bool:
+        ts = entry_timestamp(entry)
+        if ts:
+            self.newest = max(self.newest, ts)
+        if ts and self.high_water:
+            stale = ts < self.high_water
+        else:
+            link = getattr(entry, "link", None)
+            stale = bool(self.count_seen and link and make_ad_id(link) in seen)
+        self.streak = self.streak + 1 if stale else 0
+        return self.streak >= FEED_STALE_STREAK
+
+def candidates(app: App, plan: list, futures: dict, claimed: set, completed: list):
+    # si scaricano solo FETCH_WORKERS sorgenti davanti a quella in lettura: se il
+    # run si ferma presto le altre non partono (e restano da leggere al prossimo)
+    sched = app.scheduler
+
+    def is_new(ad_id: bytes) -> bool:
+        if ad_id in claimed or ad_id in app.seen:
+            # src è la sorgente del ciclo qui sotto
+            stats.source(src.url, "deduped")
+            return False
+        return True
+
+    for k, src in enumerate(plan):
+        start_fetches(app.fetch_pool, plan[k:k + FETCH_WORKERS], futures)
+        try:
+            with stats.timer("fetch_wait"):
+                r = futures.pop(src.url).result()
         except Exception as e:
-            print(f"[ERR] Scrape fallito {page_url}: {e}")
+            print(f"[ERR] Download fallito {src.url}: {e}")
+            stats.source(src.url, "errors")
+            sched.failed(src.url)
             continue
-        for item in items:
-            if posted >= MAX_POSTS_PER_RUN:
+        sched.fetched(src.url)
+        stats.source(src.url, "fetch_ms", round(r.elapsed.total_seconds() * 1000))
+        # i feed in streaming non hanno il corpo intero: niente hash né cursore
+        page_hash = None if streamed(src) else content_hash(r)
+        if page_hash:
+            stats.source(src.url, "bytes", len(r.content))
+        if not_modified(src.url, r, page_hash):
+            r.close()
+            print(f"[OK] Invariata: {src.url}")
+            stats.source(src.url, "not_modified")
+            continue
+        try:
+            with stats.timer("parse"):
+                entries = source_entries(src, r)
+        except Exception as e:
+            print(f"[ERR] Parsing fallito {src.url}: {e}")
+            stats.source(src.url, "errors")
+            sched.failed(src.url)
+            continue
+        if isinstance(entries, list):
+            stats.source(src.url, "entries", len(entries))
+
+        build = scrape_candidate if src.kind == "scrape" else feed_candidate
+        cutoff = None
+        if src.kind == "feed":
+            cutoff = FeedCutoff(sched.high_water(src.url), count_seen=not sched.interrupted(src.url))
+        start = sched.cursor(src.url, page_hash) if page_hash else 0
+        try:
+            for i, entry in islice(enumerate(entries), start, None):
+                if cutoff and cutoff.stop(entry, app.seen):
+                    print(f"[OK] {src.url}: voci già viste, lettura interrotta")
+                    stats.source(src.url, "early_stop")
+                    break
+                c = filter_entry(app, src, build, entry, is_new, claimed)
+                if c is None:
+                    continue
+                sched.yielded(src.url)
+                # se il run si ferma qui, il prossimo riparte dalla voce successiva
+                # (per i feed in streaming il cursore dice solo che ci si è fermati)
+                sched.set_cursor(src.url, i + 1, page_hash)
+                yield c
+        except ValueError as e:
+            # feed troncato o malformato a metà lettura
+            print(f"[ERR] Parsing fallito {src.url}: {e}")
+            stats.source(src.url, "errors")
+            sched.failed(src.url)
+            continue
+        finally:
+            close = getattr(entries, "close", None)
+            if close:
+                close()
+        sched.set_cursor(src.url, 0, None)
+        completed.append((src.url, r, page_hash, cutoff.newest if cutoff else 0.0))
+
+def filter_entry(app: App, src: Source, build, entry, is_new, claimed: set) -> dict | None:
+    stats.source(src.url, "examined")
+    with stats.timer("filter"):
+        c = build(src, entry, is_new)
+        if c is None:
+            return None
+        # nessun canale vuole questa specie/paese
+        c["channels"] = channels_for(c)
+        if not c["channels"]:
+            return None
+        # già preso da un altro shard o processo che usa lo stesso ads.db
+        if not take_lease(c["ad_id"], app.owner, LEASE_TTL_SEC):
+            stats.source(src.url, "deduped")
+            return None
+        # stesso animale già pubblicato da un'altra sorgente: niente traduzione
+        c["simhash"] = simhash(c["title"] + "\n" + c["raw"])
+        near_dup = c["simhash"] is not None and app.near.find(c["simhash"])
+    claimed.add(c["ad_id"])
+    stats.source(src.url, "candidates")
+    if near_dup:
+        print(f"[OK] Quasi duplicato: {c['title']}")
+        stats.source(src.url, "near_dups")
+        app.seen.add(c["ad_id"], c["save_url"])
+        return None
+    if c["simhash"] is not None:
+        app.near.claim(c["simhash"])
+    stats.source(src.url, "queued")
+    return c
+
+def translate_stage(inbox: queue.Queue, outbox: queue.Queue, consumer: threading.Thread, failed_sources: set):
+    try:
+        while True:
+            c = inbox.get()
+            if c is _DONE:
                 break
-            ad_id = hashlib.sha256((item["page"] + "|" + item["name"]).encode()).hexdigest()
-            if already_sent(ad_id):
-                continue
-            raw = clean_html(item["desc"] or item["name"])
-            raw = remove_wp_footer(raw)
-            # filtro adozioni
-            if not looks_like_adoption(item["name"], raw):
-                continue
-            species = item["species"] or "other"
-            country = fixed_country or "UNK"
-            if ALLOWED_SPECIES and species not in ALLOWED_SPECIES:
-                continue
-            if ALLOWED_COUNTRIES and country not in ALLOWED_COUNTRIES:
+            # un annuncio che va storto non ferma la fase
+            try:
+                c = prepare_messages(c, failed_sources)
+            except Exception as e:
+                print(f"[ERR] Preparazione fallita: {c['title']} | {e}")
+                stats.source(c["source"], "errors")
+                failed_sources.add(c["source"])
                 continue
-            en, it, es, fr, de, lang = translate_all(raw)
-            hashtags = build_hashtags(species, country, lang)
-            msg = build_message(
-                item["name"],
-                species,
-                country,
-                en, it, es, fr, de,
-                item["page"],
-                hashtags
+            if c is not None and not hand_off(outbox, c, consumer):
+                break
+    finally:
+        hand_off(outbox, _DONE, consumer)
+        close_db()
+
+def prepare_messages(c: dict, failed_sources: set) -> dict | None:
+    with stats.timer("lang"):
+        lang = text_language(c["raw"], c["lang_hint"])
+    stats.incr("lang_" + lang.method)
+    if lang.method == "detect" and lang.confidence < LANG_MIN_CONFIDENCE:
+        print(f"[WARN] Lingua incerta ({lang.code} {lang.confidence:.2f}): {c['title']}")
+        stats.incr("lang_low_confidence")
+    # una traduzione per tutte le lingue dei canali di destinazione
+    languages = list(dict.fromkeys(l for ch in c["channels"] for l in ch["languages"]))
+    # testo già pubblicato (ripubblicazione, stesso annuncio su un altro
+    # URL): le traduzioni vengono dall'archivio
+    texts = archived_texts(c["raw"], lang.code)
+    try:
+        if all(l in texts for l in languages):
+            stats.incr("archive_reused")
+        else:
+            with stats.timer("translate"):
+                texts = translate_for(c["raw"], lang.code, languages)
+    except Exception as e:
+        print(f"[ERR] Traduzione fallita: {c['title']} | {e}")
+        stats.source(c["source"], "errors")
+        failed_sources.add(c["source"])
+        return None
+    hashtags = build_hashtags(c["species"], c["country"], lang.code)
+    c["lang"], c["texts"], c["hashtags"] = lang.code, texts, hashtags
+    # per canale: didascalia per foto/album e testo per il ripiego
+    c["messages"] = {
+        ch["chat"]: tuple(
+            build_message(
+                c["title"],
+                c["species"],
+                c["country"],
+                texts,
+                ch["languages"],
+                c["url"],
+                hashtags,
+                limit=limit,
             )
-            img = item["images"][0] if item["images"] else None
-            send_post(item["name"], msg, img, image_referer=item["page"])
-            save_ad(ad_id, item["page"] + "#" + item["name"])
-            posted += 1
-            time.sleep(SLEEP_BETWEEN_POSTS_SEC)
-    
-    # --- 2) RSS feeds
-    for feed_url in FEEDS:
-        if posted >= MAX_POSTS_PER_RUN:
-            break
-        feed = feedparser.parse(feed_url)
-        if getattr(feed, "bozo", 0):
-            print(f"[WARN] Feed problematico: {feed_url} | {getattr(feed, 'bozo_exception', '')}")
+            for limit in (TELEGRAM_CAPTION_MAX, TELEGRAM_TEXT_MAX)
+        )
+        for ch in c["channels"]
+    }
+    return c
+
+def send_stage(app: App, inbox: queue.Queue):
+    # SLEEP_BETWEEN_POSTS_SEC è l'intervallo minimo tra due invii; i 429 di
+    # Telegram vengono gestiti in telegram_call con il loro retry_after
+    last_sent = 0.0
+    try:
+        while True:
+            c = inbox.get()
+            if c is _DONE:
+                break
+            # un annuncio che va storto non ferma la fase (e la coda a monte)
+            try:
+                last_sent = send_candidate(app, c, last_sent)
+            except Exception as e:
+                print(f"[ERR] Invio fallito: {c['title']} | {e}")
+                stats.source(c["source"], "errors")
+    finally:
+        close_db()
+
+def send_candidate(app: App, c: dict, last_sent: float) -> float:
+    images = [im for im in (resolve_image(p, u) for u, p in c["pending"]) if im]
+    posted, file_ids = False, []
+    for chat, (caption, text) in c["messages"].items():
+        wait = last_sent + SLEEP_BETWEEN_POSTS_SEC - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        with stats.timer("send"):
+            sent = send_post(app.bot, chat, c["title"], caption, text, images)
+        last_sent = time.monotonic()
+        if sent is None:
             continue
-        for e in feed.entries:
-            if posted >= MAX_POSTS_PER_RUN:
+        posted = True
+        stats.incr("channel_posts")
+        for image, file_id in sent:
+            image_remember(image, file_id)
+            if file_id not in file_ids:
+                file_ids.append(file_id)
+        images = reuse_uploads(images, sent)
+    stats.source(c["source"], "posted" if posted else "errors")
+    # segnato come visto prima dell'archivio: se l'archivio fallisce non si ripubblica
+    app.seen.add(c["ad_id"], c["save_url"])
+    if c["simhash"] is not None:
+        app.near.add(c["ad_id"], c["simhash"])
+    if posted:
+        archive_post(c, file_ids)
+    return last_sent
+
+def start_images(app: App, c: dict) -> list:
+    urls = c["images"][:ALBUM_MAX_IMAGES if POST_ALBUMS else 1]
+    return [(u, start_image(app.image_pool, u, c["referer"])) for u in urls]
+
+def run(app: App, plan: list, outbox: bool = False):
+    # outbox=True (shard): gli annunci tradotti vanno al publisher invece che a Telegram
+    translate_q = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    send_q = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    failed_sources = set()
+    sender = (
+        threading.Thread(target=outbox_stage, args=(send_q,), name="outbox") if outbox
+        else threading.Thread(target=send_stage, args=(app, send_q), name="send")
+    )
+    translator = threading.Thread(
+        target=translate_stage, args=(translate_q, send_q, sender, failed_sources), name="translate"
+    )
+    workers = [translator, sender]
+    for w in workers:
+        w.start()
+
+    claimed, completed = set(), []
+    futures = {}
+    queued = 0
+    try:
+        if MAX_POSTS_PER_RUN > 0:
+            for c in candidates(app, plan, futures, claimed, completed):
+                # le immagini si scaricano mentre il testo viene tradotto
+                if not outbox:
+                    c["pending"] = start_images(app, c)
+                if not hand_off(translate_q, c, translator):
+                    break
+                queued += 1
+                if queued >= MAX_POSTS_PER_RUN:
+                    break
+    finally:
+        drop_fetches(futures)
+        hand_off(translate_q, _DONE, translator)
+        for w in workers:
+            w.join()
+
+    # validator HTTP e high-water mark salvati solo per le sorgenti percorse
+    # fino in fondo
+    for url, r, page_hash, newest in completed:
+        if url not in failed_sources:
+            http_cache_store(url, r, page_hash)
+            if newest:
+                app.scheduler.set_high_water(url, newest)
+    # traduzione fallita: la sorgente va riletta da capo
+    for url in failed_sources:
+        app.scheduler.set_cursor(url, 0, None)
+
+# ======================
+# SHARD E OUTBOX
+# ======================
+# Con --shards N ogni processo legge solo le sorgenti dei propri host e mette
+# gli annunci tradotti in outbox; le lease sugli id impediscono che due
+# processi lavorino lo stesso annuncio. Il publisher (uno alla volta, con la
+# sua lease) svuota l'outbox con la stessa send_stage del run normale.
+OUTBOX_FIELDS = (
+    "source", "save_url", "title", "raw", "species", "country", "url", "images",
+    "referer", "simhash", "lang", "texts", "hashtags", "messages",
+)
+PUBLISHER_LEASE = b"publisher"
+
+def shard_of(src: Source, shards: int) -> int:
+    # per host: sessione, circuit breaker e latenza restano in un solo processo
+    digest = hashlib.blake2b(url_host(src.url).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shards
+
+def outbox_pending() -> int:
+    return db().execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+def outbox_stage(inbox: queue.Queue):
+    try:
+        while True:
+            c = inbox.get()
+            if c is _DONE:
                 break
-            link = getattr(e, "link", None)
-            title = getattr(e, "title", None)
-            if not link or not title:
-                continue
-            ad_id = hashlib.sha256(link.encode()).hexdigest()
-            if already_sent(ad_id):
-                continue
-            raw_html = getattr(e, "summary", "") or getattr(e, "description", "") or title
-            raw = clean_html(raw_html)
-            raw = remove_wp_footer(raw)
-            # filtro adozioni
-            if not looks_like_adoption(title, raw):
-                continue
-            species = detect_species(title, raw, default="other")
-            country = detect_country(link)
-            if ALLOWED_SPECIES and species not in ALLOWED_SPECIES:
+            # senza riga in outbox la lease viene liberata a fine run: si riprova
+            try:
+                payload = json.dumps({k: c[k] for k in OUTBOX_FIELDS}, ensure_ascii=False).encode()
+                conn = db()
+                with conn:
+                    conn.execute(
+                        "INSERT OR IGNORE INTO outbox VALUES (NULL,?,?,?)",
+                        (c["ad_id"], int(time.time()), zlib.compress(payload, ARCHIVE_ZLIB_LEVEL)),
+                    )
+            except Exception as e:
+                print(f"[ERR] Outbox fallita: {c['title']} | {e}")
+                stats.source(c["source"], "errors")
                 continue
-            if ALLOWED_COUNTRIES and country not in ALLOWED_COUNTRIES:
+            stats.incr("outbox_queued")
+            print(f"[OK] In outbox: {c['title']}")
+    finally:
+        close_db()
+
+def publish(app: App, limit: int = MAX_POSTS_PER_RUN) -> int:
+    if not take_lease(PUBLISHER_LEASE, app.owner, PUBLISHER_LEASE_SEC):
+        print("[WARN] Un altro publisher è attivo: outbox lasciata com'è")
+        return 0
+    send_q = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    sender = threading.Thread(target=send_stage, args=(app, send_q), name="send")
+    sender.start()
+    drained, queued = [], 0
+    try:
+        rows = db().execute("SELECT id, ad_id, payload FROM outbox ORDER BY id")
+        for row_id, ad_id, payload in rows:
+            if queued >= limit:
+                break
+            drained.append((row_id, ad_id))
+            c = json.loads(zlib.decompress(payload))
+            c["ad_id"] = ad_id
+            stats.source(c["source"], "examined")
+            # pubblicato nel frattempo da un run senza shard
+            if ad_id in app.seen:
+                stats.source(c["source"], "deduped")
                 continue
-            en, it, es, fr, de, lang = translate_all(raw)
-            hashtags = build_hashtags(species, country, lang)
-            msg = build_message(
-                title.strip(),
-                species,
-                country,
-                en, it, es, fr, de,
-                link,
-                hashtags
-            )
-            image_url = pick_image_from_feed(e)
-            send_post(title, msg, image_url, image_referer=link)
-            save_ad(ad_id, link)
-            posted += 1
-            time.sleep(SLEEP_BETWEEN_POSTS_SEC)
+            stats.source(c["source"], "candidates")
+            # stesso animale messo in outbox da due shard diversi
+            if c["simhash"] is not None:
+                if app.near.find(c["simhash"]):
+                    print(f"[OK] Quasi duplicato: {c['title']}")
+                    stats.source(c["source"], "near_dups")
+                    app.seen.add(ad_id, c["save_url"])
+                    continue
+                app.near.claim(c["simhash"])
+            c["pending"] = start_images(app, c)
+            if not hand_off(send_q, c, sender):
+                break
+            queued += 1
+        rows.close()
+    finally:
+        hand_off(send_q, _DONE, sender)
+        sender.join()
+    # prima seen_ads, poi outbox e lease: un crash a metà non fa ripubblicare
+    app.seen.flush()
+    conn = db()
+    with conn:
+        conn.executemany("DELETE FROM outbox WHERE id=?", [(row_id,) for row_id, _ in drained])
+        conn.executemany("DELETE FROM leases WHERE key=?", [(ad_id,) for _, ad_id in drained])
+        conn.execute("DELETE FROM leases WHERE key=?", (PUBLISHER_LEASE,))
+    print(f"[OK] Outbox: {queued} inviati, {len(drained) - queued} scartati, {outbox_pending()} in attesa")
+    return queued
 
-if __name__ == "__main__":
+# ======================
+# APP
+# ======================
+class App:
+    # stato di un run (bot, DB, pool): creato in main(), mai all'import.
+    # Gli shard non hanno token: non parlano con Telegram
+    def __init__(self, token: str | None, role: str = "run"):
+        stats.reset()
+        self.owner = f"{role}-{os.getpid()}"
+        self.bot = None
+        if token:
+            from telegram import Bot
+
+            self.bot = Bot(token)
+        init_db()
+        health.load(db())
+        self.seen = SeenStore(db())
+        self.near = NearDupIndex(db())
+        self.scheduler = Scheduler(db())
+        self.fetch_pool = ThreadPoolExecutor(max_workers=FETCH_WORKERS)
+        self.image_pool = ThreadPoolExecutor(max_workers=IMAGE_WORKERS)
+
+    def close(self) -> None:
+        self.fetch_pool.shutdown(wait=False, cancel_futures=True)
+        self.image_pool.shutdown(wait=False, cancel_futures=True)
+        close_sessions()
+        try:
+            self.seen.flush()
+            self.near.flush()
+            self.scheduler.save()
+            health.save(db())
+            release_leases(self.owner)
+            # pulizia una volta per ciclo, non in ogni shard
+            if self.bot:
+                self.seen.expire(SEEN_RETENTION_DAYS)
+                self.near.expire()
+                trim_translation_cache()
+                archive_expire()
+        finally:
+            close_db()
+            if RUN_REPORT_PATH:
+                stats.write(RUN_REPORT_PATH)
+                print(f"[OK] Report del run: {RUN_REPORT_PATH}")
+
+def collect(app: App, shard: tuple | None = None) -> None:
+    # sorgenti scelte dallo scheduler, scaricate in parallelo (a finestra),
+    # elaborate in ordine
+    # host sospesi dal circuit breaker: nemmeno in lista
+    sources = all_sources()
+    if shard:
+        index, count = shard
+        sources = [src for src in sources if shard_of(src, count) == index]
+    ready = [src for src in sources if not health.is_open(url_host(src.url))]
+    if len(ready) < len(sources):
+        print(f"[WARN] {len(sources) - len(ready)} sorgenti saltate: host sospesi")
+    plan = app.scheduler.plan(ready)
+    run(app, plan, outbox=shard is not None)
+
+def require_token() -> None:
+    if not BOT_TOKEN:
+        raise RuntimeError("BOT_TOKEN non trovato. Imposta il secret BOT_TOKEN su GitHub Actions.")
+
+def main():
+    require_token()
+    app = App(BOT_TOKEN)
     try:
-        main()
+        collect(app)
+    finally:
+        app.close()
+
+def shard_main(index: int, count: int, report: str = "") -> None:
+    # uno shard: niente Telegram, il report va in un file per shard
+    global RUN_REPORT_PATH
+    if report:
+        root, ext = os.path.splitext(report)
+        RUN_REPORT_PATH = f"{root}.shard{index}{ext}"
+    app = App(None, role=f"shard{index}")
+    try:
+        if outbox_pending() >= OUTBOX_MAX_PENDING:
+            print(f"[WARN] Outbox piena ({OUTBOX_MAX_PENDING}): shard {index}/{count} fermo")
+            return
+        collect(app, (index, count))
+    finally:
+        app.close()
+
+def publisher_main() -> None:
+    require_token()
+    app = App(BOT_TOKEN, role="publisher")
+    try:
+        publish(app)
+    finally:
+        app.close()
+
+def sharded_main(count: int) -> None:
+    # gli shard girano in parallelo su più core, poi un solo publisher invia
+    import multiprocessing
+
+    require_token()
+    init_db()
+    close_db()
+    procs = [
+        multiprocessing.Process(target=shard_main, args=(i, count, RUN_REPORT_PATH), name=f"shard{i}")
+        for i in range(count)
+    ]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    failed = [p.name for p in procs if p.exitcode]
+    if failed:
+        print(f"[WARN] Shard terminati con errore: {', '.join(failed)}")
+    publisher_main()
+
+def profile_main(tool: str) -> None:
+    # run.prof si apre con `python -m pstats run.prof` o snakeviz
+    if tool == "pyinstrument":
+        from pyinstrument import Profiler
+
+        profiler = Profiler()
+        profiler.start()
+        try:
+            main()
+        finally:
+            profiler.stop()
+            with open("run.html", "w", encoding="utf-8") as f:
+                f.write(profiler.output_html())
+            print("[OK] Profilo: run.html")
+        return
+
+    import cProfile
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(main)
     finally:
-        conn.close()
+        profiler.dump_stats("run.prof")
+        print("[OK] Profilo: run.prof")
 
+# ======================
+# STARTUP REPORT
+# ======================
+def startup_report(budget_ms: int = STARTUP_BUDGET_MS, top: int = 10) -> bool:
+    import subprocess
+
+    # `python -X importtime -c "import main"` in un processo pulito
+    here = os.path.dirname(os.path.abspath(__file__))
+    err = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=here, capture_output=True, text=True,
+    ).stderr
+
+    # righe "import time: self | cumulative | <indent>nome"; i figli precedono
+    # il genitore, quindi si raccolgono i moduli di livello 1 fino a "main"
+    children, total_ms, self_ms = [], None, None
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cum_us, name = line[len("import time:"):].split("|")
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        if level == 0:
+            if name == "main":
+                total_ms, self_ms = int(cum_us) / 1000, int(self_us) / 1000
+                break
+            children = []
+        elif level == 1:
+            children.append((int(cum_us) / 1000, int(self_us) / 1000, name))
 
+    if total_ms is None:
+        print(f"[ERR] import main fallito:\n{err}")
+        return False
 
+    print(f"{'cumulative ms':>14} {'self ms':>8}  module")
+    print(f"{total_ms:14.1f} {self_ms:8.1f}  main")
+    for cum, self_, name in sorted(children, reverse=True)[:top]:
+        print(f"{cum:14.1f} {self_:8.1f}    {name}")
+    ok = total_ms <= budget_ms
+    print(f"[{'OK' if ok else 'ERR'}] import main: {total_ms:.1f} ms (budget {budget_ms} ms)")
+    return ok
 
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Global Animal Adoptions bot")
+    parser.add_argument("--startup-report", action="store_true", help="misura il tempo di import e lo confronta con STARTUP_BUDGET_MS")
+    parser.add_argument("--report", default=RUN_REPORT_PATH, help="file JSON del report del run (vuoto per non scriverlo)")
+    parser.add_argument("--profile", choices=("cprofile", "pyinstrument"), help="profila il run (run.prof o run.html)")
+    sharding = parser.add_mutually_exclusive_group()
+    sharding.add_argument("--shards", type=int, metavar="N", help="N processi shard in parallelo, poi il publisher")
+    sharding.add_argument("--shard", metavar="K/N", help="solo lo shard K di N (job separati sullo stesso ads.db)")
+    sharding.add_argument("--publish", action="store_true", help="solo il publisher: svuota l'outbox verso Telegram")
+    archive = parser.add_argument_group("archivio", "interroga gli annunci pubblicati invece di eseguire il bot")
+    archive.add_argument("--search", nargs="?", const="", metavar="TESTO", help="ricerca full-text (vuoto: solo filtri)")
+    archive.add_argument("--species", help="dog, cat, other")
+    archive.add_argument("--country", help="codice paese, es. IT")
+    archive.add_argument("--since", help="finestra (7d, 24h, 2w) o data ISO")
+    archive.add_argument("--limit", type=int, default=ARCHIVE_SEARCH_LIMIT)
+    archive.add_argument("--show", type=int, metavar="ID", help="annuncio completo con traduzioni e immagini")
+    args = parser.parse_args()
+
+    if args.startup_report:
+        sys.exit(0 if startup_report() else 1)
+    if args.search is not None or args.show or args.species or args.country or args.since:
+        archive_cli(args)
+        sys.exit(0)
+    RUN_REPORT_PATH = args.report
+    if args.shards:
+        sharded_main(args.shards)
+    elif args.shard:
+        index, _, count = args.shard.partition("/")
+        if not (index.isdigit() and count.isdigit() and int(index) < int(count)):
+            parser.error("--shard vuole K/N con 0 <= K < N, es. 0/4")
+        shard_main(int(index), int(count), RUN_REPORT_PATH)
+    elif args.publish:
+        publisher_main()
+    elif args.profile:
+        profile_main(args.profile)
+    else:
+        main()